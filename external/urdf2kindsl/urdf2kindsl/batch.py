@@ -0,0 +1,200 @@
+import os, io, sys, glob, json, inspect, hashlib, logging, multiprocessing
+
+from urdf2kindsl import urdf, convert, kindsl, numeric
+from urdf2kindsl import stats as statistics
+
+logger = logging.getLogger(__name__)
+
+'''
+Conversion of many URDF models at once, across a pool of processes, with an
+optional cache of the generated documents.
+
+The cache is content-addressed: the key of an entry is the hash of the URDF
+bytes together with all the settings affecting the output (see
+`defaultSettings()`) and the source code of the modules generating it, so
+that any change to the tool invalidates the existing entries. A model whose
+key is found in the cache is not parsed nor converted again; the cached
+document is simply copied to the destination.
+'''
+
+key_digits    = 'digits'
+key_pi_digits = 'pi_digits'
+key_floating  = 'floating'
+
+
+def defaultSettings():
+    return {
+        convert.opt_key_prune    : False,
+        convert.opt_key_toframes : True,
+        convert.opt_key_lumpi    : True,
+        key_digits    : 6,
+        key_pi_digits : 5,
+        key_floating  : False
+    }
+
+
+def convertSource(source, ofile, settings, stats=None):
+    '''Full conversion of the given URDF source (a path or a file object),
+    writing the Kinematics-DSL document on `ofile`.
+
+    Returns the `stats.Stats` of the conversion, which is `stats` itself if
+    given.
+    '''
+    if stats is None :
+        stats = statistics.Stats()
+    converterOpts = {
+        convert.opt_key_prune    : settings[convert.opt_key_prune],
+        convert.opt_key_toframes : settings[convert.opt_key_toframes],
+        convert.opt_key_lumpi    : settings[convert.opt_key_lumpi]
+    }
+    with stats :
+        with stats.stage(statistics.stage_parse) :
+            urdfin = urdf.URDFWrapper( source )
+        conv = convert.Converter( urdfin, converterOpts, stats )
+        form = kindsl.NumFormatter( round_digits=settings[key_digits], pi_round_digits=settings[key_pi_digits])
+        ser  = kindsl.Serializer(ofile, numFormatter=form, floating=settings[key_floating])
+        with stats.stage(statistics.stage_serialize) :
+            ser.writeModel(conv)
+    return stats
+
+
+_toolDigest = None
+
+def toolDigest():
+    '''Hash of the source code of the modules which determine the output'''
+    global _toolDigest
+    if _toolDigest is None :
+        h = hashlib.sha256()
+        for module in (urdf, convert, numeric, kindsl, sys.modules[__name__]) :
+            with open(inspect.getsourcefile(module), 'rb') as f :
+                h.update( f.read() )
+        _toolDigest = h.hexdigest()
+    return _toolDigest
+
+
+def cacheKey(urdfBytes, settings):
+    h = hashlib.sha256()
+    h.update( urdfBytes )
+    opts = dict( (k, settings[k]) for k in defaultSettings().keys() )
+    opts['tool'] = toolDigest()
+    h.update( json.dumps(opts, sort_keys=True).encode('utf-8') )
+    return h.hexdigest()
+
+
+def writeAtomically(path, text):
+    tmp = '{0}.{1}.tmp'.format(path, os.getpid())
+    with io.open(tmp, 'w', encoding='utf-8') as f :
+        f.write(text)
+    os.rename(tmp, path)
+
+
+def _makeDirs(path):
+    try :
+        os.makedirs(path)
+    except OSError :
+        if not os.path.isdir(path) :
+            raise
+
+
+def convertFile(urdfPath, outPath, settings, cacheDir=None, stats=None):
+    '''Converts one URDF file, going through the cache if `cacheDir` is given.
+    The `stats` argument is passed to `convertSource()`; it is left untouched
+    in case of a cache hit.
+
+    Returns True if the output was taken from the cache.
+    '''
+    with open(urdfPath, 'rb') as f :
+        data = f.read()
+
+    cached = None
+    if cacheDir is not None :
+        _makeDirs(cacheDir)
+        cached = os.path.join(cacheDir, cacheKey(data, settings) + '.kindsl')
+        if os.path.isfile(cached) :
+            with io.open(cached, 'r', encoding='utf-8') as f :
+                writeAtomically(outPath, f.read())
+            logger.info("'{0}' found in cache".format(urdfPath))
+            return True
+
+    text = io.StringIO()
+    convertSource( io.BytesIO(data), text, settings, stats )
+    writeAtomically(outPath, text.getvalue())
+    if cached is not None :
+        writeAtomically(cached, text.getvalue())
+    return False
+
+
+def _convertJob(job):
+    (urdfPath, outPath, settings, cacheDir, profile) = job
+    stats = None
+    if profile is not None :
+        stats = statistics.Stats(name=urdfPath, memory=profile)
+    cached = convertFile(urdfPath, outPath, settings, cacheDir, stats)
+    if cached :
+        stats = None
+    return (urdfPath, outPath, cached, stats)
+
+
+def collectInputs(paths):
+    '''The list of URDF files given by `paths`; each directory is replaced by
+    the `*.urdf` files it contains
+    '''
+    inputs = []
+    for path in paths :
+        if os.path.isdir(path) :
+            inputs.extend( sorted(glob.glob(os.path.join(path, '*.urdf'))) )
+        else :
+            inputs.append(path)
+    return inputs
+
+
+def outputPaths(inputs, outDir):
+    '''The list of (input, output) pairs, where the output for `<name>.urdf`
+    is `outDir/<name>.kindsl`
+    '''
+    ret = []
+    outputs = {}
+    for path in inputs :
+        name = os.path.splitext( os.path.basename(path) )[0]
+        out  = os.path.join(outDir, name + '.kindsl')
+        if out in outputs :
+            raise ValueError("Inputs '{0}' and '{1}' would both be converted to '{2}'".format(outputs[out], path, out))
+        outputs[out] = path
+        ret.append( (path, out) )
+    return ret
+
+
+def convertMany(paths, outDir, settings=None, cacheDir=None, jobs=None, profile=None):
+    '''Converts all the given URDF files (or directories of URDF files).
+
+    The output for `<name>.urdf` is `outDir/<name>.kindsl`. The conversions
+    run in parallel on `jobs` processes (defaults to the number of CPUs).
+    Returns a list of (input, output, cached, stats) tuples, in the input
+    order. `stats` is None unless `profile` is given; in that case, `profile`
+    tells whether to measure also the memory allocations (see
+    `stats.Stats`). Models taken from the cache have no stats.
+    '''
+    if settings is None :
+        settings = defaultSettings()
+    work = [ (path, out, settings, cacheDir, profile) for (path, out) in outputPaths(collectInputs(paths), outDir) ]
+
+    _makeDirs(outDir)
+    if cacheDir is not None :
+        _makeDirs(cacheDir)
+
+    if jobs is None :
+        jobs = multiprocessing.cpu_count()
+    jobs = max(1, min(jobs, len(work)))
+    if jobs == 1 :
+        results = [_convertJob(job) for job in work]
+    else :
+        pool = multiprocessing.Pool(jobs)
+        try :
+            results = pool.map(_convertJob, work, chunksize=1)
+        finally :
+            pool.close()
+            pool.join()
+
+    hits = sum(1 for r in results if r[2])
+    logger.info("Converted {0} models ({1} from cache)".format(len(results), hits))
+    return results
@@ -1,5 +1,6 @@
-import sys, logging, argparse
-from urdf2kindsl import urdf, convert, kindsl
+import io, os, sys, logging, argparse
+from urdf2kindsl import urdf, convert, kindsl, batch, verify, watch
+from urdf2kindsl import stats as statistics
 
 logLevels = {}
 logLevels['debug']   = logging.DEBUG
@@ -12,8 +13,8 @@ def main() :
     argparser = argparse.ArgumentParser(
         description='Convert a URDF model to a Kinematics-DSL model')
 
-    argparser.add_argument('urdf', metavar='URDF-input',
-            help='path of the URDF input file')
+    argparser.add_argument('urdf', metavar='URDF-input', nargs='+',
+            help='path of the URDF input file, or - to read from stdin; with --output-dir, any number of files or directories of *.urdf files')
     argparser.add_argument('-o', '--output',
             help='destination file (defaults to stdout)')
     argparser.add_argument('--digits',
@@ -42,6 +43,36 @@ def main() :
     argparser.set_defaults(toframes=True)
     argparser.set_defaults(floating=False)
 
+    group = argparser.add_argument_group('Batch conversion', 'Convert many models at once, in parallel')
+    group.add_argument('--output-dir', dest='outdir',
+            help='destination directory; <name>.urdf is converted to <name>.kindsl in this directory')
+    group.add_argument('--cache-dir', dest='cachedir',
+            help='directory of previously generated documents, used to skip the models that did not change')
+    group.add_argument('-j', '--jobs', type=int,
+            help='number of parallel conversion processes (defaults to the number of CPUs)')
+
+    group = argparser.add_argument_group('Watch mode', 'Keep running, and convert the inputs again whenever they change')
+    group.add_argument('--watch', action='store_true',
+            help='watch the input files, which must be converted to --output or --output-dir; stop with Ctrl-C')
+    group.add_argument('--watch-interval', dest='interval', type=float, default=watch.default_interval,
+            help='seconds between two checks of the input files (default {0})'.format(watch.default_interval))
+
+    group = argparser.add_argument_group('Profiling', 'Time, memory allocations and counters of each stage of the conversion')
+    group.add_argument('--profile', action='store_true',
+            help='print the statistics of the conversion of each model on stderr')
+    group.add_argument('--stats-json', dest='statsjson', metavar='FILE',
+            help='write the statistics of the conversion of each model to FILE, in JSON format')
+    group.add_argument('--no-memory', dest='memory', action='store_false',
+            help='do not measure the memory allocations, which slows down the conversion')
+
+    group = argparser.add_argument_group('Verification', 'Check the generated model against the URDF, on random joint configurations')
+    group.add_argument('--verify', action='store_true',
+            help='read back the generated model and compare it with the URDF; the exit status is non-zero if the check fails')
+    group.add_argument('--verify-samples', dest='samples', type=int, default=verify.default_samples,
+            help='number of random joint configurations (default {0})'.format(verify.default_samples))
+    group.add_argument('--verify-tolerance', dest='tolerance', type=float, default=verify.default_tolerance,
+            help='maximum acceptable error (default {0})'.format(verify.default_tolerance))
+
     argparser.add_argument('--log-level', type=str, dest='loglevel',
             default='warning',
             help='logging level, chosen among debug, info, warning, error (defaults to warning)')
@@ -54,23 +85,136 @@ def main() :
 
     logging.basicConfig(level= logLevels[args.loglevel])
 
-    ofile = sys.stdout
-    if( args.output is not None) :
-        ofile = open(args.output, 'w')
+    settings = {
+        convert.opt_key_prune    : args.prunefixed,
+        convert.opt_key_toframes : args.toframes,
+        convert.opt_key_lumpi    : args.lumpinertia,
+        batch.key_digits    : args.digits,
+        batch.key_pi_digits : args.pi_digits,
+        batch.key_floating  : args.floating
+    }
+
+    profile = None
+    if args.profile or args.statsjson is not None :
+        profile = args.memory
+
+    pairs = None
+    if args.outdir is not None :
+        try :
+            pairs = batch.outputPaths( batch.collectInputs(args.urdf), args.outdir )
+        except ValueError as e :
+            argparser.error(str(e))
+
+    if args.watch :
+        # The warm models take the place of the cache, and the conversions
+        # happen one at a time
+        for (option, given) in [('--cache-dir', args.cachedir is not None), ('--jobs', args.jobs is not None),
+                                ('--verify', args.verify)] :
+            if given :
+                argparser.error('{0} is not supported with --watch'.format(option))
+        if args.outdir is not None :
+            if not os.path.isdir(args.outdir) :
+                os.makedirs(args.outdir)
+        elif len(args.urdf) == 1 and args.urdf[0] != '-' and args.output is not None :
+            pairs = [ (args.urdf[0], args.output) ]
+        else :
+            argparser.error('--watch requires input files, and --output or --output-dir')
+        # Report each conversion, unless the user asked for less
+        if logLevels[args.loglevel] > logging.INFO :
+            logging.getLogger(watch.__name__).setLevel(logging.INFO)
+        callback = None
+        if profile is not None :
+            collected = []
+            def callback(stats) :
+                # The JSON file lists all the conversions so far
+                collected.append(stats)
+                if args.profile :
+                    stats.report(sys.stderr)
+                if args.statsjson is not None :
+                    with open(args.statsjson, 'w') as f :
+                        statistics.writeJSON(collected, f)
+        watch.Watcher(pairs, settings).run(args.interval, callback, memory=(profile is True))
+        return
+
+    if args.outdir is not None :
+        results = batch.convertMany(args.urdf, args.outdir, settings, cacheDir=args.cachedir, jobs=args.jobs, profile=profile)
+        writeStats(args, [r[3] for r in results if r[3] is not None])
+        if args.verify :
+            verifyOutputs(args, [(r[0], r[1]) for r in results])
+        return
+    if len(args.urdf) > 1 :
+        argparser.error('multiple inputs require --output-dir')
+
+    source = args.urdf[0]
+    if source == '-' :
+        # Read the raw bytes, the XML parser takes care of the encoding
+        source = getattr(sys.stdin, 'buffer', sys.stdin)
+        if args.verify :
+            # The input is read twice
+            source = io.BytesIO( source.read() )
+
+    stats = None
+    if profile is not None :
+        stats = statistics.Stats(name=args.urdf[0], memory=profile)
 
-    urdfin = urdf.URDFWrapper( args.urdf )
     if args.link_origin is not None :
+        urdfin = urdf.URDFWrapper( source )
         urdf.linkOrigin(urdfin, args.link_origin)
+        return
+    elif args.cachedir is not None and args.output is not None and args.urdf[0] != '-' :
+        if batch.convertFile(args.urdf[0], args.output, settings, cacheDir=args.cachedir, stats=stats) :
+            stats = None
+        writeStats(args, [] if stats is None else [stats])
+        if args.verify :
+            verifyOutputs(args, [(args.urdf[0], args.output)])
     else :
-        converterOpts = {
-            convert.opt_key_prune : args.prunefixed,
-            convert.opt_key_toframes : args.toframes,
-            convert.opt_key_lumpi : args.lumpinertia
-        }
-        conv = convert.Converter( urdfin, converterOpts )
-        form = kindsl.NumFormatter( round_digits=args.digits, pi_round_digits=args.pi_digits)
-        ser  = kindsl.Serializer(ofile, numFormatter=form, floating=args.floating)
-        ser.writeModel(conv)
+        ofile = sys.stdout
+        if( args.output is not None) :
+            ofile = open(args.output, 'w')
+        text = io.StringIO() if args.verify else ofile
+        batch.convertSource(source, text, settings, stats)
+        writeStats(args, [] if stats is None else [stats])
+        if args.verify :
+            ofile.write(text.getvalue())
+            ofile.flush()
+            if hasattr(source, 'seek') :
+                source.seek(0)
+            verifyOutputs(args, [(source, io.StringIO(text.getvalue()))])
+
+
+def verifyOutputs(args, pairs) :
+    '''Checks each pair of URDF source and generated Kinematics-DSL document,
+    and exits with a non-zero status if any check fails
+    '''
+    # The inertia of pruned links is lost, if not lumped
+    inertia = args.lumpinertia or not args.prunefixed
+    failed = False
+    for (urdfSource, kindslSource) in pairs :
+        if not hasattr(kindslSource, 'read') :
+            kindslSource = open(kindslSource, 'r')
+        with kindslSource :
+            doc = kindsl.parse(kindslSource)
+        name = urdfSource if not hasattr(urdfSource, 'read') else args.urdf[0]
+        report = verify.check(urdf.URDFWrapper(urdfSource), doc, args.samples, inertia=inertia)
+        failures = report.failures(args.tolerance)
+        if len(failures) > 0 :
+            failed = True
+            sys.stderr.write("Verification of '{0}' failed\n".format(name))
+            for f in failures :
+                sys.stderr.write('  ' + f + '\n')
+        else :
+            logging.getLogger(__name__).info("Verification of '{0}' passed".format(name))
+    if failed :
+        sys.exit(1)
+
+
+def writeStats(args, statsList) :
+    if args.profile :
+        for stats in statsList :
+            stats.report(sys.stderr)
+    if args.statsjson is not None :
+        with open(args.statsjson, 'w') as f :
+            statistics.writeJSON(statsList, f)
 
 if __name__ == '__main__':
     main()
@@ -3,6 +3,7 @@ import numpy as np
 from collections import OrderedDict as ODict
 
 from urdf2kindsl import numeric
+from urdf2kindsl import stats as statistics
 
 logger = logging.getLogger(__name__)
 
@@ -12,16 +13,42 @@ opt_key_toframes = 'toframes'
 opt_key_lumpi = 'lumpinertia'
 
 
+class ModelArrays :
+    '''Struct-of-arrays representation of a converted model.
+
+    The links are numbered in depth-first order starting from the root,
+    which is the same numbering of the Kinematics-DSL document. For each link
+    `i`, `parents[i]` is the index of the parent link (-1 for the root), and
+    `H[i]` and `rot[i]` describe the frame of the supporting joint, in the
+    coordinates of the parent link. `inertia` has the layout described in the
+    `numeric` module.
+    '''
+    __slots__ = ('linkNames', 'jointNames', 'jointTypes', 'parents', 'H', 'rot', 'inertia')
+
+    def __init__(self, n):
+        self.linkNames  = [None] * n
+        self.jointNames = [None] * n
+        self.jointTypes = [None] * n
+        self.parents = np.full(n, -1, dtype=int)
+        self.H       = np.tile( np.identity(4), (n,1,1) )
+        self.rot     = np.zeros( (n,3) )
+        self.inertia = np.zeros( (n,numeric.inertia_size) )
+
+
 class Converter :
     '''Reads the model from a URDFWrapper instance, and applies the necessary conversions
     '''
     class Frame :
-        def __init__(self):
-            self.H   = np.identity(4)    # Homogeneous coordinate transform, from this-instance-coordinates to some link coordinates
+        __slots__ = ('H', 'rot', 'tr')
+        def __init__(self, H=None):
+            # Homogeneous coordinate transform, from this-instance-coordinates to some link coordinates.
+            # It can be a view on a bigger array holding many transforms
+            self.H   = np.identity(4) if H is None else H
             self.rot = (0.0, 0.0, 0.0)   # Intrinsic rx, ry, rz angles
             self.tr  = self.H[0:3,3]     # View of the translation vector
 
     class Link :
+        __slots__ = ('name', 'parent', 'parentJ', 'children', 'inertia', 'frames', 'rcg_R_urdf')
         def __init__(self, namestr):
             self.name    = namestr
             self.parent  = None
@@ -32,19 +59,19 @@ class Converter :
             self.rcg_R_urdf = np.identity(3)
 
     class Joint :
-        def __init__(self, namestr):
+        __slots__ = ('name', 'type', 'predecessor', 'successor', 'frame')
+        def __init__(self, namestr, H=None):
             self.name = namestr
             self.type = 'revolute'
             self.predecessor = None
             self.successor  = None
-            self.frame = Converter.Frame()
-
+            self.frame = Converter.Frame(H)
 
     @staticmethod
     def toValidID( name ) :
         return name.replace('-', '__')
 
-    def __init__(self, urdf, options={}) :
+    def __init__(self, urdf, options={}, stats=None) :
         if opt_key_prune not in options:
             options[opt_key_prune] = False
         if opt_key_toframes not in options:
@@ -52,85 +79,195 @@ class Converter :
         if opt_key_lumpi not in options :
             options[opt_key_lumpi] = True
 
-        self.robotName = urdf.robotName
-        self.links  = ODict()
-        self.joints = ODict()
-        self.frames = ODict()
-
-        for urdfname in urdf.links.keys() :
-            name = self.toValidID( urdfname )
-            link = Converter.Link( name )
-            self.links[name] = link
-
-        for jname in urdf.joints.keys() :
-            urdfjoint = urdf.joints[jname]
-            name = self.toValidID( jname )
-            joint= Converter.Joint( name )
-            joint.type = urdfjoint.type
-
-            joint.predecessor = self.links[ self.toValidID(urdfjoint.parent) ]
-            joint.successor   = self.links[ self.toValidID(urdfjoint.child)  ]
-            self.convertJointFrame(joint, urdfjoint)
-
-            joint.successor.parent = joint.predecessor
-            joint.successor.parentJ= joint
-            joint.predecessor.children.append( (joint.successor, joint) )
-            self.joints[name] = joint
-
-        orphans = [l for l in self.links.values() if l.parent==None]
-        if len(orphans)==0 :
-            logger.fatal("Could not find any root link (i.e. a link without parent).")
-            logger.fatal("Check for kinematic loops.")
-            raise RuntimeError("no root link found")
-        if len(orphans) > 1 :
-            logger.warning("Found {0} links without parent, only one expected".format(len(orphans)))
-            logger.warning("Any robot model must have exactly one root element.")
-            logger.warning("This might lead to unexpected results.")
-        self.root = orphans[0]
-
-        self.leafs = [l for l in self.links.values() if len(l.children)==0]
+        # Time and counters of the conversion; pass a Stats instance to
+        # collect them together with the other stages
+        self.stats = statistics.Stats() if stats is None else stats
+        with self.stats :
+            self.stats.set(statistics.counter_links_in , len(urdf.links))
+            self.stats.set(statistics.counter_joints_in, len(urdf.joints))
+            for counter in (statistics.counter_pruned, statistics.counter_frames, statistics.counter_lumped) :
+                self.stats.count(counter, 0)
+
+            self.robotName = urdf.robotName
+            self.links  = ODict()
+            self.joints = ODict()
+            self.frames = ODict()
+
+            for urdfname in urdf.links.keys() :
+                name = self.toValidID( urdfname )
+                link = Converter.Link( name )
+                self.links[name] = link
+
+            # All the joint transforms are stored in one contiguous array
+            self.jointsH = np.tile( np.identity(4), (len(urdf.joints),1,1) )
+            urdfJoints = {}
+            with self.stats.stage(statistics.stage_joints) :
+                for (i, jname) in enumerate(urdf.joints.keys()) :
+                    urdfjoint = urdf.joints[jname]
+                    name = self.toValidID( jname )
+                    joint= Converter.Joint( name, self.jointsH[i] )
+                    joint.type = urdfjoint.type
+
+                    joint.predecessor = self.links[ self.toValidID(urdfjoint.parent) ]
+                    joint.successor   = self.links[ self.toValidID(urdfjoint.child)  ]
+
+                    joint.successor.parent = joint.predecessor
+                    joint.successor.parentJ= joint
+                    joint.predecessor.children.append( (joint.successor, joint) )
+                    self.joints[name] = joint
+                    urdfJoints[name] = urdfjoint
+
+                # The conversion of a joint frame depends on the rcg_R_urdf of the
+                # predecessor link, which is set by the conversion of its parent
+                # joint. The URDF does not have to list the parent joints first,
+                # so the ancestors of each joint are converted before the joint
+                converted = set()
+                for joint in self.joints.values() :
+                    path = []
+                    while joint is not None and joint.name not in converted :
+                        converted.add(joint.name) # also stops at kinematic loops
+                        path.append(joint)
+                        joint = joint.predecessor.parentJ
+                    for joint in reversed(path) :
+                        self.convertJointFrame(joint, urdfJoints[joint.name])
+
+            orphans = [l for l in self.links.values() if l.parent==None]
+            if len(orphans)==0 :
+                logger.fatal("Could not find any root link (i.e. a link without parent).")
+                logger.fatal("Check for kinematic loops.")
+                raise RuntimeError("no root link found")
+            if len(orphans) > 1 :
+                logger.warning("Found {0} links without parent, only one expected".format(len(orphans)))
+                logger.warning("Any robot model must have exactly one root element.")
+                logger.warning("This might lead to unexpected results.")
+            self.root = orphans[0]
+
+            self.leafs = [l for l in self.links.values() if len(l.children)==0]
+
+            # Conversion of the inertia must happen after the joint frame conversion,
+            # which determines the required coordinate transforms
+            with self.stats.stage(statistics.stage_inertia) :
+                self.convertInertialData(
+                    [self.links[self.toValidID(urdfname)] for urdfname in urdf.links.keys()],
+                    [urdflink.inertia for urdflink in urdf.links.values()] )
+
+            if options[opt_key_prune] :
+                self.prune(options)
+
+            self.stats.set(statistics.counter_links_out , len(self.links))
+            self.stats.set(statistics.counter_joints_out, len(self.joints))
+
+    def prune(self, options):
+        '''Removes the fixed joints and their successor links, according to
+        the given options; see _pruneFixedJoints()
+        '''
+        with self.stats.stage(statistics.stage_prune) :
+            changed = self._pruneFixedJoints(options)
+        self.stats.set(statistics.counter_links_out , len(self.links))
+        self.stats.set(statistics.counter_joints_out, len(self.joints))
+        return changed
 
-        # Conversion of the inertia must happen after the joint frame conversion,
-        # which determines the required coordinate transforms
-        for urdfname in urdf.links.keys() :
-            name = self.toValidID( urdfname )
-            self.convertInertialData(self.links[name], urdf.links[urdfname].inertia)
-
-        if options[opt_key_prune] :
-            # Let's first explicitly check for the nasty case where the root is
-            # a dummy link, connected via a fixed joint to the first link
-            self._collapseDummyRoots()
-            self._pruneFixedJoints(options)
-
-    def _collapseDummyRoots(self):
-        root = self.root
-        keepGoing = True
-        while self.isDummyLink(root) and keepGoing :
-            if len(root.children) > 1 :
-                logger.warning("Detected dummy root link ({0}) with multiple children; cannot collapse".format(root.name))
-                keepGoing = False
-                for childPair in root.children :
-                    childPair[1].__preserve = True
-            else :
-                childSpec = root.children[0]
-                joint = childSpec[1]
-                child = childSpec[0]
-                if joint.type != 'fixed' :
-                    logger.warning("Detected dummy root link ({0}) supporting a non-fixed joint ({1})".format(root.name, joint.name))
-                    keepGoing = False
-                    joint.__preserve = True
-                else :
-                    # We have a dummy root link, with only one child connected via fixed joint.
-                    # Let's delete it and replace the root
-                    logger.info("Deleting dummy pair '{0}'-'{1}', root replaced with '{2}'".format(
-                        root.name, joint.name, child.name))
-                    root = child
-                    del self.links[root.name]
-                    del self.joints[joint.name]
-
-        self.root = root
+    def copy(self, stats=None):
+        '''A copy of the model, which can be modified (e.g. pruned) without
+        affecting this one. The counters of the changes to the copy go to
+        `stats`, if given.
+        '''
+        ret = Converter.__new__(Converter)
+        ret.stats = statistics.Stats() if stats is None else stats
+        ret.robotName = self.robotName
+        ret.frames = ODict(self.frames)
+        ret.links  = ODict()
+        ret.joints = ODict()
+        for link in self.links.values() :
+            copy = Converter.Link( link.name )
+            # Pruning replaces the values of the inertia and the frames, it
+            # does not modify them in place
+            copy.inertia = dict(link.inertia)
+            copy.frames  = ODict(link.frames)
+            copy.rcg_R_urdf = link.rcg_R_urdf
+            ret.links[link.name] = copy
+
+        ret.jointsH = np.array( [joint.frame.H for joint in self.joints.values()] ).reshape( (len(self.joints),4,4) )
+        for (i, joint) in enumerate(self.joints.values()) :
+            copy = Converter.Joint( joint.name, ret.jointsH[i] )
+            copy.type = joint.type
+            copy.frame.rot   = joint.frame.rot
+            copy.predecessor = ret.links[joint.predecessor.name]
+            copy.successor   = ret.links[joint.successor.name]
+            copy.successor.parent  = copy.predecessor
+            copy.successor.parentJ = copy
+            ret.joints[joint.name] = copy
+        for link in self.links.values() :
+            ret.links[link.name].children = [(ret.links[child.name], ret.joints[joint.name]) for (child, joint) in link.children]
+
+        ret.root  = ret.links[self.root.name]
+        ret.leafs = [l for l in ret.links.values() if len(l.children)==0]
+        return ret
+
+    def update(self, urdf, joints=(), links=()):
+        '''Converts again the given joints and the inertia of the given links
+        (URDF names) of `urdf`, a new version of the URDF model this instance
+        was built from, with the same links and joints. It must not be used
+        after pruning.
+
+        The conversion of a joint frame depends on the rcg_R_urdf of the
+        predecessor link, so the joints in the subtree of each given joint are
+        converted again as well, together with the inertia of their links.
+        Returns the number of joints and of links converted again.
+        '''
+        self.robotName = urdf.robotName
+        urdfJoints = { self.toValidID(name) : joint for (name, joint) in urdf.joints.items() }
+        urdfLinks  = { self.toValidID(name) : link  for (name, link)  in urdf.links.items() }
+        changed = set( self.toValidID(name) for name in joints )
+
+        # The changed joints without changed ancestors; converting their
+        # subtrees covers all the others
+        roots = []
+        for name in changed :
+            joint = self.joints[name]
+            ancestor = joint.predecessor.parentJ
+            while ancestor is not None and ancestor.name not in changed :
+                ancestor = ancestor.predecessor.parentJ
+            if ancestor is None :
+                roots.append(joint)
+
+        todo = ODict( (self.toValidID(name), self.links[self.toValidID(name)]) for name in links )
+        count = 0
+        with self.stats.stage(statistics.stage_joints) :
+            stack = list(roots)
+            while len(stack) > 0 :
+                joint = stack.pop()
+                urdfjoint = urdfJoints[joint.name]
+                joint.type = urdfjoint.type
+                self.convertJointFrame(joint, urdfjoint)
+                todo[joint.successor.name] = joint.successor
+                stack.extend( j for (l, j) in joint.successor.children )
+                count += 1
+
+        with self.stats.stage(statistics.stage_inertia) :
+            self.convertInertialData( list(todo.values()), [urdfLinks[name].inertia for name in todo.keys()] )
+        self.stats.count(statistics.counter_joints_redone, count)
+        self.stats.count(statistics.counter_links_redone, len(todo))
+        return (count, len(todo))
 
     def _pruneFixedJoints(self, options):
+        '''Removes all the fixed joints and their successor links, in one pass.
+
+        Conceptually, the links to be deleted are processed one at a time, in
+        the order of the model: each one is removed from the children of its
+        current parent, and its own children are appended to those of the
+        parent. Its frame, its custom frames and its inertia are moved to the
+        parent as well. The processing order determines the order of the
+        children and of the frames in the output, so it must be preserved.
+
+        However, nothing is actually moved or composed more than once. Each
+        deleted link keeps a reference to its nearest non-deleted ancestor,
+        together with the transform relative to it (with path compression,
+        like in a union-find structure). The lists of children and frames are
+        spliced by reference, and flattened only at the end. This way every
+        transform is composed once, and the angles of every frame in the
+        output are decomposed once.
+        '''
         # Use a list to preserve the order in which the links are added. This
         # ensures the same computation for different runs of the tool on the
         # same robot model, which makes the output deterministic.
@@ -141,72 +278,110 @@ class Converter :
             if joint is not None and parent is not None:
                 if joint.type == 'fixed' :
                     toBeDeleted.append(link)
-
+        self.stats.count(statistics.counter_pruned, len(toBeDeleted))
+
+        deleted  = set()  # names of the links processed so far
+        upward   = {}     # name -> [ancestor, H], H being the transform from the link frame to the ancestor frame
+        attached = {}     # name -> (ancestor, rot) as of the time the link was deleted
+        children = {}     # name -> list of (successor, joint) pairs, and of deleted links to be spliced in
+        frames   = {}     # name -> list of (name, Frame) pairs, and of deleted links to be spliced in
+
+        def getList(lists, link, initial) :
+            if link.name not in lists :
+                lists[link.name] = list(initial)
+            return lists[link.name]
+
+        def nearestKept(link) :
+            # The nearest ancestor of a deleted link which is not deleted yet,
+            # and the transform from the link frame to the ancestor frame
+            path = []
+            while upward[link.name][0].name in deleted :
+                path.append(link)
+                link = upward[link.name][0]
+            (ancestor, H) = upward[link.name]
+            for l in reversed(path) :
+                entry = upward[l.name]
+                H = np.matmul( H, entry[1] )
+                entry[0] = ancestor
+                entry[1] = H
+            return (ancestor, H)
+
+        def frameOf(link) :
+            # The current frame of a deleted link, relative to its nearest
+            # non-deleted ancestor. The angles are not decomposed again if the
+            # transform did not change since the deletion of the link.
+            (ancestor, H) = nearestKept(link)
+            (deletedFrom, rot) = attached[link.name]
+            if rot is None or ancestor is not deletedFrom :
+                rot = numeric.getIntrinsicXYZFromR( H[0:3,0:3] )
+                attached[link.name] = (ancestor, rot)
+            return (ancestor, H, rot)
+
+        lumpi = options[opt_key_lumpi]
+        lumps = []           # the inertias to be moved to the parent links, in order
+        lumpTargets = set()  # the names of the links with pending lumps
         for deleteme in toBeDeleted :
             joint  = deleteme.parentJ
             parent = deleteme.parent
 
             logger.debug("Pruning link '{0}', connected by joint '{1}'".format(deleteme.name, joint.name))
 
-            # First of all, we need to move up the children of 'deleteme', i.e.
-            # the grandfather becomes the father
-            parent.children.remove( (deleteme, joint) )
-            for (successor, sjoint) in deleteme.children :
-                successor.parent = parent # 'parent' is currently the grandparent of 'successor'
-                parent.children.append( (successor, sjoint) )
+            if parent.name in deleted :
+                (parent, H) = nearestKept(parent)
+                H = np.matmul( H, joint.frame.H )
+                rot = None
+            else :
+                H = joint.frame.H
+                rot = joint.frame.rot
+            upward[deleteme.name]   = [parent, H]
+            attached[deleteme.name] = (parent, rot)
+            deleted.add(deleteme.name)
 
-                # Now we have to adapt the joint frame data ...
-                jframe = sjoint.frame
-                # We need the [:,:] to assign values to the same memory
-                # location, because the translation attribute is a view
-                # of H. If we change H, the view will be inconsistent
-                jframe.H[:,:] = np.matmul( joint.frame.H, jframe.H )
-                jframe.rot = numeric.getIntrinsicXYZFromR( jframe.H[0:3,0:3] )
-
-            if options[opt_key_toframes] :
-                # We need to "move" the frames associated with 'deleteme' into
-                # the parent frames. First of all, the implicit link frame,
-                # which is the same as the supporting-joint frame:
-                parent.frames[deleteme.name] = joint.frame
-
-                # Then the additional custom frames on the link; for these
-                # ones we must perform a coordinate transform
-                for ufr in deleteme.frames.keys() :
-                    original = deleteme.frames[ufr]
-                    shiftedup= Converter.Frame()
-                    # We need the [:,:] to assign values to the same memory
-                    # location, because the translation attribute is a view
-                    # of H. If we change H, the view will be inconsistent
-                    shiftedup.H[:,:] = np.matmul( joint.frame.H, original.H )
-                    shiftedup.rot = numeric.getIntrinsicXYZFromR( shiftedup.H[0:3,0:3] )
-                    parent.frames[ufr] = shiftedup
-
-            if options[opt_key_lumpi] :
+            # The grandfather becomes the father of the children of 'deleteme'
+            getList(children, parent, parent.children).append( deleteme )
+            getList(frames, parent, parent.frames.items()).append( deleteme )
+
+            if lumpi :
                 # Keep in mind that at this point all the inertia properties
                 # are in robcogen format, that is, in link coordinates. And
-                # the link frame is the same as the supporting-joint frame
+                # the link frame is the same as the supporting-joint frame.
+                # The inertia of 'deleteme' must be complete, before we read it
+                if deleteme.name in lumpTargets :
+                    self._lumpInertia(lumps)
+                    lumpTargets.clear()
                 if deleteme.inertia['mass'] != 0 :
-                    loadMe = parent.inertia
-                    parent_R_leaf = numeric.getR_intrinsicXYZ( *joint.frame.rot )
+                    rot = frameOf(deleteme)[2]
+                    parent_R_leaf = numeric.getR_intrinsicXYZ( *rot )
 
                     # The translation we need is the position of the parent
                     # link frame relative to the joint frame, in joint frame
                     # coordinates
-                    tr = - np.matmul( parent_R_leaf.T , joint.frame.tr )
-                    # Transform the inertia of the link in the coordinate
-                    # system of the parent link
-                    addMe = numeric.rotoTranslateInertia(deleteme.inertia, tr, parent_R_leaf)
-                    m1 = loadMe['mass']
-                    m2 = addMe['mass']
-
-                    loadMe['mass'] = m1 + m2
-                    loadMe['Ix']  = loadMe['Ix']  + addMe['Ix']
-                    loadMe['Iy']  = loadMe['Iy']  + addMe['Iy']
-                    loadMe['Iz']  = loadMe['Iz']  + addMe['Iz']
-                    loadMe['Ixy'] = loadMe['Ixy'] + addMe['Ixy']
-                    loadMe['Ixz'] = loadMe['Ixz'] + addMe['Ixz']
-                    loadMe['Iyz'] = loadMe['Iyz'] + addMe['Iyz']
-                    loadMe['com'] = (loadMe['com']*m1 + addMe['com']*m2)/(m1+m2)
+                    tr = - np.matmul( parent_R_leaf.T , H[0:3,3] )
+                    lumps.append( (parent, deleteme, tr, parent_R_leaf) )
+                    lumpTargets.add( parent.name )
+                    self.stats.count(statistics.counter_lumped)
+
+        self._lumpInertia(lumps)
+
+        # Now rebuild the remaining links, and the joints that were moved
+        for link in self.links.values() :
+            if link.name in deleted :
+                continue
+            joint = link.parentJ
+            if joint is not None and link.parent.name in deleted :
+                (link.parent, H) = nearestKept(link.parent)
+                # We need the [:,:] to assign values to the same memory
+                # location, because the translation attribute is a view
+                # of H. If we change H, the view will be inconsistent
+                joint.frame.H[:,:] = np.matmul( H, joint.frame.H )
+                joint.frame.rot = numeric.getIntrinsicXYZFromR( joint.frame.H[0:3,0:3] )
+
+            if link.name in children :
+                link.children = self._spliceChildren(children, link, deleted)
+            if options[opt_key_toframes] and link.name in frames :
+                own = len(link.frames)
+                link.frames = self._spliceFrames(frames, link, frameOf)
+                self.stats.count(statistics.counter_frames, len(link.frames) - own)
 
         changed = len(toBeDeleted) > 0
         for eraseMe in toBeDeleted :
@@ -220,6 +395,99 @@ class Converter :
         self.leafs = [l for l in self.links.values() if len(l.children)==0]
         return changed
 
+    @staticmethod
+    def _lumpInertia(lumps):
+        '''Adds the inertia of each link to the inertia of the given parent,
+        with all the coordinate transforms computed in one batch
+        '''
+        if len(lumps) == 0 :
+            return
+        iin = np.array( [numeric.inertiaToArray(lump[1].inertia) for lump in lumps] )
+        tr  = np.array( [lump[2] for lump in lumps] )
+        R   = np.array( [lump[3] for lump in lumps] )
+        # Transform the inertia of the links in the coordinate system of the
+        # parent links
+        iout = numeric.batchRotoTranslateInertia(iin, tr, R)
+        for (lump, addMe) in zip(lumps, iout) :
+            loadMe = lump[0].inertia
+            m1 = loadMe['mass']
+            m2 = addMe[numeric.inertia_mass]
+
+            loadMe['mass'] = m1 + m2
+            for (k, v) in zip(numeric.inertia_moments_keys, addMe[numeric.inertia_moments]) :
+                loadMe[k] = loadMe[k] + v
+            loadMe['com'] = (loadMe['com']*m1 + addMe[numeric.inertia_com]*m2)/(m1+m2)
+        del lumps[:]
+
+    @staticmethod
+    def _spliceChildren(lists, link, deleted):
+        ret = list()
+        stack = [ iter(lists[link.name]) ]
+        while len(stack) > 0 :
+            item = next(stack[-1], None)
+            if item is None :
+                stack.pop()
+            elif isinstance(item, Converter.Link) :
+                stack.append( iter(lists.get(item.name, item.children)) )
+            elif item[0].name not in deleted :
+                ret.append(item)
+        return ret
+
+    @staticmethod
+    def _spliceFrames(lists, link, frameOf):
+        ret = ODict()
+        # Each entry of the stack also holds the transform from the frames of
+        # the list to the frame of 'link', None if they coincide
+        stack = [ (iter(lists[link.name]), None) ]
+        while len(stack) > 0 :
+            (items, owner_H) = stack[-1]
+            item = next(items, None)
+            if item is None :
+                stack.pop()
+            elif isinstance(item, Converter.Link) :
+                # The frame of the deleted link is the frame of its
+                # supporting joint, which is deleted as well, so we can
+                # reuse the same object
+                (ancestor, H, rot) = frameOf(item)
+                frame = item.parentJ.frame
+                if frame.H is not H :
+                    frame.H[:,:] = H
+                frame.rot = rot
+                ret[item.name] = frame
+                stack.append( (iter(lists.get(item.name, item.frames.items())), H) )
+            elif owner_H is None :
+                ret[item[0]] = item[1]
+            else :
+                shiftedup = Converter.Frame()
+                shiftedup.H[:,:] = np.matmul( owner_H, item[1].H )
+                shiftedup.rot = numeric.getIntrinsicXYZFromR( shiftedup.H[0:3,0:3] )
+                ret[item[0]] = shiftedup
+        return ret
+
+    def toArrays(self):
+        '''The ModelArrays representation of the current state of the model
+        '''
+        order = []
+        stack = [ (self.root, -1) ]
+        while len(stack) > 0 :
+            (link, parent) = stack.pop()
+            order.append( (link, parent) )
+            me = len(order) - 1
+            for (child, joint) in reversed(link.children) :
+                stack.append( (child, me) )
+
+        ret = ModelArrays( len(order) )
+        for (i, (link, parent)) in enumerate(order) :
+            ret.linkNames[i] = link.name
+            ret.parents[i]   = parent
+            ret.inertia[i]   = numeric.inertiaToArray(link.inertia)
+            if parent >= 0 :
+                joint = link.parentJ
+                ret.jointNames[i] = joint.name
+                ret.jointTypes[i] = joint.type
+                ret.H[i]   = joint.frame.H
+                ret.rot[i] = joint.frame.rot
+        return ret
 
     def isDummyLink(self, link):
         immaterial = link.inertia['mass'] == 0.0
@@ -229,20 +497,23 @@ class Converter :
 
         return (immaterial and fixedj)
 
-    def convertInertialData(self, link, urdfParams):
-        iin = {}
-        iin['mass'] = urdfParams['mass']
-        iin['com']  = np.zeros(3)
-        iin['Ix']   =  urdfParams['ixx']
-        iin['Iy']   =  urdfParams['iyy']
-        iin['Iz']   =  urdfParams['izz']
-        iin['Ixy']  = -urdfParams['ixy']
-        iin['Ixz']  = -urdfParams['ixz']
-        iin['Iyz']  = -urdfParams['iyz']
-
-        tr = -np.array(urdfParams['xyz'])
-        iout = numeric.rotoTranslateInertia(iin, tr, link.rcg_R_urdf)
-        link.inertia = iout
+    def convertInertialData(self, links, urdfParams):
+        '''Converts the inertia parameters of all the given links at once
+
+        `urdfParams` is the list of the URDF parameters of each link, see
+        `URDFWrapper.readInertialData()`.
+        '''
+        iin = np.zeros( (len(links), numeric.inertia_size) )
+        tr  = np.empty( (len(links), 3) )
+        for (i, params) in enumerate(urdfParams) :
+            iin[i,numeric.inertia_mass] = params['mass']
+            iin[i,numeric.inertia_moments] = (params['ixx'], params['iyy'], params['izz'],
+                                             -params['ixy'], -params['ixz'], -params['iyz'])
+            tr[i] = params['xyz']
+        R = np.array( [link.rcg_R_urdf for link in links] ).reshape( (len(links),3,3) )
+        iout = numeric.batchRotoTranslateInertia(iin, -tr, R)
+        for (link, row) in zip(links, iout) :
+            link.inertia = numeric.inertiaFromArray(row)
 
     def convertJointFrame(self, joint, urdfjoint):
         rpy = urdfjoint.frame['rpy']
@@ -281,13 +552,13 @@ class Converter :
                  cos(rx) cos(ry) = axis_z
             '''
             axis_rounded = np.round(axis_linkframe, 5)
-            ry = math.asin( axis_linkframe[0] )
+            ry = numeric.clampedAsin( axis_linkframe[0] )
             if axis_rounded[2] != 0.0 :
                 rx = math.atan2( -axis_linkframe[1], axis_linkframe[2])
             else :
                 cy = math.cos(ry)
                 if round(cy,5) != 0.0 :
-                    rx = math.asin( - axis_linkframe[1] / cy )
+                    rx = numeric.clampedAsin( - axis_linkframe[1] / cy )
                 else:
                     rx = 0.0
             rz = 0.0;
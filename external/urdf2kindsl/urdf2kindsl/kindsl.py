@@ -1,9 +1,15 @@
-import math
+import re, math
+import numpy as np
+from collections import OrderedDict as ODict
+
 from urdf2kindsl import numeric
 
 class NumFormatter :
     '''Rounds the floating point numbers for pretty printing
     '''
+    # Upper bound for the number of memoized strings
+    max_cache_size = 1 << 16
+
     def __init__(self, round_digits=6, pi_round_digits=5):
         self.round_decimals = round_digits
         self.pi_round_decimals = pi_round_digits
@@ -12,8 +18,24 @@ class NumFormatter :
         self.roundedHalfPI = round(math.pi/2, self.pi_round_decimals)
 
         self.formatStr = '0:.' + str(self.round_decimals)
+        self.__general = ( "{" + self.formatStr + "}" ).format
+        self.__fixed   = ( "{" + self.formatStr + "f}" ).format
+
+        # Robot models contain many repeated numbers (zeros, PI, the same
+        # offsets for each leg, ...), so we memoize the formatted strings
+        self.__cache = ( dict(), dict() )  # for plain numbers and angles
 
     def float2str(self, num, angle=False ) :
+        cache = self.__cache[1 if angle else 0]
+        ret = cache.get(num)
+        if ret is None :
+            ret = self._float2str(num, angle)
+            if len(cache) >= NumFormatter.max_cache_size :
+                cache.clear()
+            cache[num] = ret
+        return ret
+
+    def _float2str(self, num, angle) :
         if angle :
             value = round(num, self.pi_round_decimals)
             sign  = "-" if value<0 else ""
@@ -29,34 +51,46 @@ class NumFormatter :
         # to fill up <n> decimal positions, which is annoying.
         # So, I first apply standard formatting (no trailing zeros), and then
         # get rid of the scientific notation in case it has been used.
-        ret = ( "{" + self.formatStr + "}" ).format( num )
+        ret = self.__general( num )
         if "e" in ret:
-            ret = ( "{" + self.formatStr + "f}" ).format( num )
+            ret = self.__fixed( num )
         return ret
 
 
 class Serializer :
     '''Writes the Kinematics-DSL document corresponding to the given Converter instance
+
+    The text is accumulated in a buffer, which is written to the output file
+    in one go by `flush()`. `writeModel()` flushes the buffer at the end or,
+    if `streaming` is true, after each link block.
     '''
-    def __init__(self, outfile, numFormatter=NumFormatter(), floating=False):
+    def __init__(self, outfile, numFormatter=NumFormatter(), floating=False, streaming=False):
         self.floating = floating
+        self.streaming = streaming
         self.__ind = 0
+        self.__prefix = ''
+        self.__buffer = []
         self.linkID = 1
         self.file = outfile
         self.formatter = numFormatter
 
     def vec3Str(self, prefix, tupl, angles=False):
-        return prefix + '({0[0]:s}, {0[1]:s}, {0[2]:s})'.format(
-            [self.formatter.float2str(s, angle=angles) for s in tupl] )
+        f = self.formatter.float2str
+        return prefix + '(' + f(tupl[0], angles) + ', ' + f(tupl[1], angles) + ', ' + f(tupl[2], angles) + ')'
 
     def indent(self):
         self.__ind += 4
+        self.__prefix = self.__ind*' '
     def indentback(self):
         self.__ind -= 4
+        self.__prefix = self.__ind*' '
     def myprint(self, text):
-        line = self.__ind*' ' + text + '\n'
-        unicodeline = line + u''   # only way I found to get an unicode for Python 2 AND 3
-        self.file.write(unicodeline)
+        self.__buffer.append( self.__prefix + text + '\n' )
+
+    def flush(self):
+        text = u''.join(self.__buffer)   # only way I found to get an unicode for Python 2 AND 3
+        self.__buffer = []
+        self.file.write(text)
 
     def _printFrame(self, tr, rot) :
         self.myprint( self.vec3Str('translation = ', tr ) )
@@ -82,11 +116,12 @@ class Serializer :
         self._blockEnd()
 
     def printInertiaParams(self, params):
+        f = self.formatter.float2str
         self._blockStart('inertia_properties')
-        self.myprint('mass = ' + self.formatter.float2str(params['mass']) )
+        self.myprint('mass = ' + f(params['mass']) )
         self.myprint( self.vec3Str('CoM = ', params['com']) )
         for m in ['Ix', 'Iy', 'Iz', 'Ixy', 'Ixz', 'Iyz'] :
-            self.myprint(m + (3-len(m))*' ' + '= ' + self.formatter.float2str(params[m]) )
+            self.myprint(m + (3-len(m))*' ' + '= ' + f(params[m]) )
         self._blockEnd()
 
     def printChildren(self, link):
@@ -111,19 +146,30 @@ class Serializer :
                 self._blockEnd()
             self._blockEnd()
 
+    def printLink(self, link):
+        self._blockStart('link ' + link.name)
+        self.myprint('id = ' + self.linkID.__str__())
+        self.printInertiaParams(link.inertia)
+        self.printChildren(link)
+        self.printUserFrames(link)
+        self._blockEnd()
+        self.myprint('\n')
+        self.linkID += 1
+
     def printLinks_DFS(self, root ) : #DFS = Depth-First-Search
-        for child in root.children:
+        # Explicit stack rather than recursion, as long kinematic chains
+        # would hit the recursion limit of the interpreter
+        stack = [ iter(root.children) ]
+        while len(stack) > 0 :
+            child = next(stack[-1], None)
+            if child is None :
+                stack.pop()
+                continue
             link = child[0]
-            self._blockStart('link ' + link.name)
-            self.myprint('id = ' + self.linkID.__str__())
-            self.printInertiaParams(link.inertia)
-            self.printChildren(link)
-            self.printUserFrames(link)
-            self._blockEnd()
-            self.myprint('\n')
-
-            self.linkID += 1
-            self.printLinks_DFS(link)
+            self.printLink(link)
+            if self.streaming :
+                self.flush()
+            stack.append( iter(link.children) )
 
 
     def writeModel(self, converted):
@@ -138,6 +184,8 @@ class Serializer :
         self.printUserFrames(robotBase)
         self._blockEnd()
         self.myprint('\n')
+        if self.streaming :
+            self.flush()
 
         self.printLinks_DFS(robotBase)
 
@@ -145,3 +193,210 @@ class Serializer :
             self.printJoint(j)
             self.myprint('')
         self.myprint('}\n')
+        self.flush()
+
+
+class Document :
+    '''The content of a Kinematics-DSL document, as read by `parse()`.
+
+    `links` contains all the links including the base, which comes first, in
+    document order. Each link has the inertia parameters in the same format
+    used by the Converter, the list of (child, joint) name pairs, and the
+    user frames as (translation, rotation) tuples. Each joint has a type
+    ('revolute' or 'prismatic') and the translation and rotation of its
+    reference frame.
+    '''
+    class Link :
+        __slots__ = ('name', 'id', 'inertia', 'children', 'frames')
+        def __init__(self, name):
+            self.name     = name
+            self.id       = None
+            self.inertia  = dict()
+            self.children = list()
+            self.frames   = ODict()
+
+    class Joint :
+        __slots__ = ('name', 'type', 'tr', 'rot')
+        def __init__(self, name, jtype):
+            self.name = name
+            self.type = jtype
+            self.tr   = (0.0, 0.0, 0.0)
+            self.rot  = (0.0, 0.0, 0.0)
+
+    def __init__(self):
+        self.robotName = None
+        self.floating  = False
+        self.base   = None
+        self.links  = ODict()
+        self.joints = ODict()
+
+
+class _Parser :
+    __token = re.compile(r'\s*(?://[^\n]*|(\d+\.?\d*(?:[eE][-+]?\d+)?|\.\d+(?:[eE][-+]?\d+)?)|([A-Za-z_]\w*)|(\S))')
+    __jointTypes = {'r_joint' : 'revolute', 'p_joint' : 'prismatic'}
+
+    def __init__(self, text):
+        self.tokens = []
+        for m in _Parser.__token.finditer(text) :
+            if m.group(1) is not None :
+                self.tokens.append( float(m.group(1)) )
+            elif m.group(2) is not None :
+                self.tokens.append( m.group(2) )
+            elif m.group(3) is not None :
+                self.tokens.append( m.group(3) )
+        self.pos = 0
+
+    def peek(self):
+        return self.tokens[self.pos] if self.pos < len(self.tokens) else None
+
+    def next(self):
+        tok = self.peek()
+        if tok is None :
+            raise ValueError("Unexpected end of the Kinematics-DSL document")
+        self.pos += 1
+        return tok
+
+    def expect(self, token):
+        tok = self.next()
+        if tok != token :
+            raise ValueError("Expected '{0}', found '{1}' in the Kinematics-DSL document".format(token, tok))
+
+    def identifier(self):
+        tok = self.next()
+        if isinstance(tok, float) or not (tok[0].isalpha() or tok[0] == '_') :
+            raise ValueError("Expected an identifier, found '{0}' in the Kinematics-DSL document".format(tok))
+        return tok
+
+    # Arithmetic expressions, with the constant PI
+    def expr(self):
+        value = self.term()
+        while self.peek() in ('+', '-') :
+            value = value + self.term() if self.next() == '+' else value - self.term()
+        return value
+
+    def term(self):
+        value = self.factor()
+        while self.peek() in ('*', '/') :
+            value = value * self.factor() if self.next() == '*' else value / self.factor()
+        return value
+
+    def factor(self):
+        tok = self.next()
+        if tok == '-' :
+            return - self.factor()
+        if tok == '(' :
+            value = self.expr()
+            self.expect(')')
+            return value
+        if tok == 'PI' :
+            return math.pi
+        if isinstance(tok, float) :
+            return tok
+        raise ValueError("Expected a number, found '{0}' in the Kinematics-DSL document".format(tok))
+
+    def vec3(self):
+        self.expect('(')
+        x = self.expr()
+        self.expect(',')
+        y = self.expr()
+        self.expect(',')
+        z = self.expr()
+        self.expect(')')
+        return (x, y, z)
+
+    def value(self):
+        # A 3D vector or a scalar expression
+        if self.peek() == '(' :
+            start = self.pos
+            try :
+                return self.vec3()
+            except ValueError :
+                self.pos = start
+        return self.expr()
+
+    def assignments(self, target):
+        self.expect('{')
+        while self.peek() != '}' :
+            key = self.identifier()
+            self.expect('=')
+            target[key] = self.value()
+        self.next()
+
+    def frame(self):
+        params = dict()
+        self.assignments(params)
+        return ( params.get('translation', (0.0,0.0,0.0)), params.get('rotation', (0.0,0.0,0.0)) )
+
+    def link(self, link):
+        self.expect('{')
+        while self.peek() != '}' :
+            key = self.identifier()
+            if key == 'id' :
+                self.expect('=')
+                link.id = int(self.expr())
+            elif key == 'inertia_properties' :
+                self.assignments(link.inertia)
+                if 'CoM' in link.inertia :
+                    link.inertia['com'] = np.array( link.inertia.pop('CoM') )
+            elif key == 'children' :
+                self.expect('{')
+                while self.peek() != '}' :
+                    child = self.identifier()
+                    self.expect('via')
+                    link.children.append( (child, self.identifier()) )
+                self.next()
+            elif key == 'frames' :
+                self.expect('{')
+                while self.peek() != '}' :
+                    name = self.identifier()
+                    link.frames[name] = self.frame()
+                self.next()
+            else :
+                raise ValueError("Unexpected '{0}' in link '{1}'".format(key, link.name))
+        self.next()
+
+    def document(self):
+        doc = Document()
+        self.expect('Robot')
+        doc.robotName = self.identifier()
+        self.expect('{')
+        while self.peek() != '}' :
+            keyword = self.identifier()
+            if keyword in ('RobotBase', 'link') :
+                link = Document.Link( self.identifier() )
+                if keyword == 'RobotBase' :
+                    if doc.base is not None :
+                        raise ValueError("More than one RobotBase in the Kinematics-DSL document")
+                    if self.peek() == 'floating' :
+                        self.next()
+                        doc.floating = True
+                    link.id = 0
+                    doc.base = link
+                self.link(link)
+                doc.links[link.name] = link
+            elif keyword in _Parser.__jointTypes :
+                joint = Document.Joint( self.identifier(), _Parser.__jointTypes[keyword] )
+                self.expect('{')
+                self.expect('ref_frame')
+                (joint.tr, joint.rot) = self.frame()
+                self.expect('}')
+                doc.joints[joint.name] = joint
+            else :
+                raise ValueError("Unexpected '{0}' in the Kinematics-DSL document".format(keyword))
+        self.next()
+        if doc.base is None :
+            raise ValueError("No RobotBase in the Kinematics-DSL document")
+        # The base first
+        del doc.links[doc.base.name]
+        links = [doc.base] + list(doc.links.values())
+        doc.links = ODict( (l.name, l) for l in links )
+        return doc
+
+
+def parse(text):
+    '''Reads a Kinematics-DSL document, as written by the Serializer; returns
+    a Document instance. Raises ValueError for syntax errors.
+    '''
+    if hasattr(text, 'read') :
+        text = text.read()
+    return _Parser(text).document()
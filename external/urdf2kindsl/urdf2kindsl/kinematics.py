@@ -0,0 +1,173 @@
+import logging
+import numpy as np
+
+from urdf2kindsl import numeric
+
+logger = logging.getLogger(__name__)
+
+
+jtype_fixed     = 0
+jtype_revolute  = 1
+jtype_prismatic = 2
+
+_urdfJointTypes = {
+    'fixed'      : jtype_fixed,
+    'revolute'   : jtype_revolute,
+    'continuous' : jtype_revolute,
+    'prismatic'  : jtype_prismatic
+}
+
+
+class ForwardKinematics :
+    '''Vectorized forward kinematics of a kinematic tree.
+
+    The tree topology and the constant transforms are computed once, at
+    construction time. Then, `poses()` computes the pose of every link, for
+    a whole batch of joint configurations at once. The links are processed
+    one tree level at a time, so the number of Python iterations depends on
+    the depth of the tree, not on the number of links or configurations.
+
+    Each link `i` has a supporting joint, which is described by:
+      - the constant transform `parent_H_joint[i]`, from joint coordinates to
+        the coordinates of the parent link
+      - the type of the joint, one of `jtype_fixed`, `jtype_revolute`,
+        `jtype_prismatic`
+      - the unit axis of the joint, in joint coordinates
+    The link frame is the joint frame displaced by the joint motion. Root
+    links have `parent` equal to -1, and their pose is `parent_H_joint[i]`.
+    '''
+
+    def __init__(self, linkNames, parents, parent_H_joint, jtypes, axes, qIndex=None, jointNames=None):
+        self.linkNames = list(linkNames)
+        self.parents   = np.array(parents, dtype=int)
+        self.parent_H_joint = np.array(parent_H_joint, dtype=float)
+        self.jtypes    = np.array(jtypes, dtype=int)
+        axes = np.array(axes, dtype=float)
+        norms = np.linalg.norm(axes, axis=1)
+        norms[norms == 0.0] = 1.0
+        self.axes = axes / norms[:,np.newaxis]
+
+        n = len(self.linkNames)
+        self.linkIndices = { name : i for i, name in enumerate(self.linkNames) }
+
+        # The column of the joint-status array for each link, -1 for the
+        # links supported by fixed joints (and for the roots). Defaults to
+        # the order of the links.
+        movable = np.flatnonzero( self.jtypes != jtype_fixed )
+        if qIndex is None :
+            qIndex = np.full(n, -1, dtype=int)
+            qIndex[movable] = np.arange(len(movable))
+        self.qIndex = np.array(qIndex, dtype=int)
+        if jointNames is None :
+            jointNames = [None] * len(movable)
+            for i in movable :
+                jointNames[ self.qIndex[i] ] = self.linkNames[i]
+        self.jointNames = list(jointNames)
+        if len(self.jointNames) != len(movable) :
+            raise ValueError("Got {0} joint names for {1} movable joints".format(
+                len(self.jointNames), len(movable)))
+
+        # The depth of each link in the tree; parents always have smaller depth
+        depth = np.full(n, -1, dtype=int)
+        for i in range(n) :
+            chain = []
+            j = i
+            while j != -1 and depth[j] == -1 :
+                chain.append(j)
+                j = self.parents[j]
+                if len(chain) > n :
+                    raise RuntimeError("kinematic loop detected at link " + self.linkNames[i])
+            d = -1 if j == -1 else depth[j]
+            for k in reversed(chain) :
+                d += 1
+                depth[k] = d
+
+        self.roots  = np.flatnonzero(depth == 0)
+        self.levels = []
+        for d in range(1, depth.max()+1 if n>0 else 1) :
+            idx = np.flatnonzero(depth == d)
+            rev = np.flatnonzero(self.jtypes[idx] == jtype_revolute)
+            pri = np.flatnonzero(self.jtypes[idx] == jtype_prismatic)
+            self.levels.append( (idx, self.parents[idx], rev, pri) )
+
+    @staticmethod
+    def fromURDF(urdf) :
+        '''Builds the kinematics of the given URDFWrapper instance.
+
+        The columns of the joint-status arrays correspond to the non-fixed
+        joints, in the order of the URDF document (see `jointNames`).
+        '''
+        linkNames = list(urdf.links.keys())
+        index = { name : i for i, name in enumerate(linkNames) }
+        n = len(linkNames)
+
+        parents = np.full(n, -1, dtype=int)
+        parent_H_joint = np.tile( np.identity(4), (n,1,1) )
+        jtypes = np.zeros(n, dtype=int)
+        axes = np.tile( np.array([1.0,0.0,0.0]), (n,1) )
+        for link in urdf.links.values() :
+            joint = link.supportingJoint
+            if joint is None :
+                continue
+            i = index[link.name]
+            parents[i] = index[joint.parent]
+            parent_H_joint[i] = joint.predec_H_joint
+            axes[i] = joint.frame['axis']
+            if joint.type in _urdfJointTypes :
+                jtypes[i] = _urdfJointTypes[joint.type]
+            else :
+                logger.warning("Unsupported type '{0}' for joint {1}, treating it as fixed".format(joint.type, joint.name))
+
+        # The joint order follows the document, not the link order
+        qIndex = np.full(n, -1, dtype=int)
+        jointNames = []
+        for joint in urdf.joints.values() :
+            i = index[joint.child]
+            if jtypes[i] != jtype_fixed :
+                qIndex[i] = len(jointNames)
+                jointNames.append(joint.name)
+        return ForwardKinematics(linkNames, parents, parent_H_joint, jtypes, axes, qIndex, jointNames)
+
+    def jointCount(self):
+        return len(self.jointNames)
+
+    def linkIndex(self, name):
+        return self.linkIndices[name]
+
+    def poses(self, q, links=None):
+        '''The poses of the links, for each of the given joint configurations.
+
+        `q` is a (N, n_joints) array (or a single configuration). The result
+        is a (N, n_links, 4, 4) array of homogeneous transforms from link
+        coordinates to root coordinates. If `links` is given (a sequence of
+        link names), only the poses of those links are returned, in the same
+        order.
+        '''
+        q = np.atleast_2d( np.asarray(q, dtype=float) )
+        if q.shape[1] != len(self.jointNames) :
+            raise ValueError("Expected {0} joint values per configuration, got {1}".format(
+                len(self.jointNames), q.shape[1]))
+        N = q.shape[0]
+
+        H = np.empty( (N, len(self.linkNames), 4, 4) )
+        H[:, self.roots] = self.parent_H_joint[self.roots]
+        for (idx, par, rev, pri) in self.levels :
+            local = np.repeat( self.parent_H_joint[idx][np.newaxis], N, axis=0 )
+            if len(rev) > 0 :
+                r = idx[rev]
+                R = numeric.batchAxisAngleR( self.axes[r], q[:, self.qIndex[r]] )
+                local[:, rev, :3, :3] = np.matmul( local[:, rev, :3, :3], R )
+            if len(pri) > 0 :
+                p = idx[pri]
+                disp = self.axes[p] * q[:, self.qIndex[p], np.newaxis]    # (N,k,3)
+                # Slice the last column: mixing the advanced index `pri` with an
+                # integer index would move the batch axis
+                local[:, pri, :3, 3:4] += np.matmul( self.parent_H_joint[p,:3,:3], disp[..., np.newaxis] )
+            H[:, idx] = np.matmul( H[:, par], local )
+
+        if links is not None :
+            return H[:, [self.linkIndices[l] for l in links]]
+        return H
+
+    def zeroConfiguration(self):
+        return np.zeros( (1, len(self.jointNames)) )
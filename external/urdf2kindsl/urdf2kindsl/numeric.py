@@ -3,6 +3,10 @@ import numpy as np
 
 close_enough_to_zero_R = 1e-10 # for the elements of rotation matrices
 
+# Process-wide counters of notable events, read by `stats.Stats`
+counter_singular = 'euler_singular_cases'
+counters = { counter_singular : 0 }
+
 '''
 Extrinsic rotations are about the axes of the original coordinate system, which
 is assumed to remain motionless. This is the convention of the 'rpy' attribute
@@ -14,6 +18,14 @@ format.
 '''
 
 
+def clampedAsin(x):
+    '''
+    math.asin() of the argument clamped to [-1,1]. Round-off errors can push
+    values like the elements of a rotation matrix slightly out of the domain
+    '''
+    return math.asin( max(-1.0, min(1.0, x)) )
+
+
 def getR_intrinsicXYZ(rx, ry, rz):
     '''
     This is the rotation matrix **base_R_rotated**, where 'rotated' is obtained
@@ -42,12 +54,18 @@ def getIntrinsicXYZFromR( Rin ) :
     # inside atan big enough to induce wrong results
     R = np.copy( Rin )
     R[ abs(R)<close_enough_to_zero_R ] = 0.0
+    R[0,2] = max(-1.0, min(1.0, R[0,2]))
+    # Round-off errors may keep R[0,2] slightly off +-1 in the singular case;
+    # the truncated R[1,2] and R[2,2] (i.e. cos(ry) = 0) tell it anyway
+    if R[1,2] == 0.0 and R[2,2] == 0.0 :
+        R[0,2] = 1.0 if R[0,2] > 0 else -1.0
 
     if R[0,2] != 1.0 and R[0,2] != -1.0 : # if not singular case, ie if not cos(ry) = 0
         ry = math.asin( R[0,2] )
         rx = math.atan2(-R[1,2], R[2,2])
         rz = math.atan2(-R[0,1], R[0,0])
     else :
+        counters[counter_singular] += 1
         # In the singular case, we use other elements of the matrix to
         # reconstruct the angles. The expressions in these elements have the
         # form of sine/cosine of the sum of rx and rz; rz can however be set
@@ -147,7 +165,7 @@ def rotoTranslateInertia(inertia, tr, R) :
     iyz = inertia['Iyz']
     tensor = np.array( [[ ixx, -ixy, -ixz],
                         [-ixy,  iyy, -iyz],
-                        [-ixy, -iyz,  izz] ])
+                        [-ixz, -iyz,  izz] ])
     tensor = tensor - mass * (np.matmul(com_x, com_x.T) - np.matmul(vec_x, vec_x.T))
 
     tensor2 = np.matmul(np.matmul(R, tensor), R.T)
@@ -161,4 +179,148 @@ def rotoTranslateInertia(inertia, tr, R) :
     ret['Ixy'] = -tensor2[0,1]
     ret['Ixz'] = -tensor2[0,2]
     ret['Iyz'] = -tensor2[1,2]
-    return ret
\ No newline at end of file
+    return ret
+
+'''
+Batched versions of the functions above. They take arrays with one leading
+dimension more than their scalar counterparts, e.g. (N,3) for the angles and
+(N,3,3) for the rotation matrices, and perform all the computations in NumPy.
+
+The batched functions use the array layout below for the inertia parameters,
+i.e. a (N,10) array whose rows have the same content as the dictionaries
+used by rotoTranslateInertia()
+'''
+inertia_mass = 0
+inertia_com  = slice(1,4)
+inertia_moments_keys = ('Ix', 'Iy', 'Iz', 'Ixy', 'Ixz', 'Iyz')
+inertia_moments = slice(4,10)
+inertia_size = 10
+
+def inertiaToArray(inertia) :
+    ret = np.empty(inertia_size)
+    ret[inertia_mass] = inertia['mass']
+    ret[inertia_com]  = inertia['com']
+    ret[inertia_moments] = [inertia[k] for k in inertia_moments_keys]
+    return ret
+
+def inertiaFromArray(row) :
+    ret = {}
+    ret['mass'] = row[inertia_mass]
+    ret['com']  = np.array( row[inertia_com] )
+    for k, v in zip(inertia_moments_keys, row[inertia_moments]) :
+        ret[k] = v
+    return ret
+
+
+def batchR_intrinsicXYZ(angles) :
+    '''(N,3) intrinsic rx, ry, rz angles to (N,3,3) rotation matrices; see getR_intrinsicXYZ()
+    '''
+    angles = np.asarray(angles, dtype=float)
+    (sx, sy, sz) = np.moveaxis( np.sin(angles), -1, 0 )
+    (cx, cy, cz) = np.moveaxis( np.cos(angles), -1, 0 )
+    return np.stack(
+        [ np.stack([cy*cz            , - cy*sz          ,sy      ], axis=-1),
+          np.stack([cx*sz + cz*sx*sy , cx*cz - sx*sy*sz , - cy*sx], axis=-1),
+          np.stack([sx*sz - cx*cz*sy , cx*sy*sz + cz*sx ,  cx*cy ], axis=-1) ], axis=-2)
+
+def batchR_extrinsicXYZ(angles) :
+    '''(N,3) extrinsic rx, ry, rz angles to (N,3,3) rotation matrices; see getR_extrinsicXYZ()
+    '''
+    angles = np.asarray(angles, dtype=float)
+    (sx, sy, sz) = np.moveaxis( np.sin(angles), -1, 0 )
+    (cx, cy, cz) = np.moveaxis( np.cos(angles), -1, 0 )
+    return np.stack(
+        [ np.stack([cy*cz,  cz*sx*sy - cx*sz,  sx*sz + cx*cz*sy], axis=-1),
+          np.stack([cy*sz,  sx*sy*sz + cx*cz,  cx*sy*sz - cz*sx], axis=-1),
+          np.stack([ - sy,        cy*sx     ,        cx*cy      ], axis=-1) ], axis=-2)
+
+def batchIntrinsicXYZFromR(Rin) :
+    '''(N,3,3) rotation matrices to (N,3) intrinsic rx, ry, rz angles; see getIntrinsicXYZFromR()
+    '''
+    R = np.array( Rin, dtype=float )
+    R[ abs(R)<close_enough_to_zero_R ] = 0.0
+
+    r02 = R[...,0,2]
+    r02 = np.where( (R[...,1,2] == 0.0) & (R[...,2,2] == 0.0), np.where(r02 > 0, 1.0, -1.0), r02 )
+    rx = np.arctan2(-R[...,1,2], R[...,2,2])
+    ry = np.arcsin( np.clip(r02, -1.0, 1.0) )
+    rz = np.arctan2(-R[...,0,1], R[...,0,0])
+
+    # Singular cases, see the scalar version
+    pos = (r02 ==  1.0)
+    neg = (r02 == -1.0)
+    counters[counter_singular] += int(np.count_nonzero(pos | neg))
+    rx = np.where(pos, np.arctan2(R[...,1,0], -R[...,2,0]), rx)
+    rx = np.where(neg, np.arctan2(R[...,2,1],  R[...,1,1]), rx)
+    ry = np.where(pos,  math.pi/2, ry)
+    ry = np.where(neg, -math.pi/2, ry)
+    rz = np.where(pos | neg, 0.0, rz)
+    return np.stack([rx, ry, rz], axis=-1)
+
+def batchAxisAngleR(axes, angles) :
+    '''
+    Rotation matrices for rotations of `angles` about the unit `axes`, with
+    the Rodrigues formula.
+
+    `axes` is a (k,3) array, `angles` is a (N,k) array. The result has shape
+    (N,k,3,3).
+    '''
+    axes = np.asarray(axes, dtype=float)
+    angles = np.asarray(angles, dtype=float)
+    x = axes[:,0]
+    y = axes[:,1]
+    z = axes[:,2]
+    zero = np.zeros_like(x)
+    K = np.stack( [np.stack([zero,   -z,    y], axis=-1),
+                   np.stack([   z, zero,   -x], axis=-1),
+                   np.stack([  -y,    x, zero], axis=-1)], axis=-2)   # (k,3,3)
+    KK = np.matmul(K, K)
+    s = np.sin(angles)[..., np.newaxis, np.newaxis]
+    c = np.cos(angles)[..., np.newaxis, np.newaxis]
+    return np.identity(3) + s*K + (1.0-c)*KK
+
+def _batch_cross_mx(r) :
+    ret = np.zeros( r.shape[:-1] + (3,3) )
+    ret[...,0,1] = -r[...,2]
+    ret[...,0,2] =  r[...,1]
+    ret[...,1,0] =  r[...,2]
+    ret[...,1,2] = -r[...,0]
+    ret[...,2,0] = -r[...,1]
+    ret[...,2,1] =  r[...,0]
+    return ret
+
+def batchRotoTranslateInertia(inertias, tr, R) :
+    '''
+    Batched rotoTranslateInertia(), for (N,10) inertia parameters (see
+    inertiaToArray()), (N,3) translations and (N,3,3) rotation matrices.
+    The result has the same layout as `inertias`.
+    '''
+    inertias = np.asarray(inertias, dtype=float)
+    mass = inertias[:,inertia_mass]
+    com  = inertias[:,inertia_com]
+    vec  = com - tr
+
+    com_x = _batch_cross_mx(com)
+    vec_x = _batch_cross_mx(vec)
+
+    (ixx, iyy, izz, ixy, ixz, iyz) = inertias[:,inertia_moments].T
+    tensor = np.stack( [np.stack([ ixx, -ixy, -ixz], axis=-1),
+                        np.stack([-ixy,  iyy, -iyz], axis=-1),
+                        np.stack([-ixz, -iyz,  izz], axis=-1)], axis=-2)
+    tensor = tensor - mass[:,np.newaxis,np.newaxis] * (
+        np.matmul(com_x, np.swapaxes(com_x,-1,-2)) - np.matmul(vec_x, np.swapaxes(vec_x,-1,-2)))
+
+    Rt = np.swapaxes(R, -1, -2)
+    tensor2 = np.matmul(np.matmul(R, tensor), Rt)
+    com2 = np.matmul(R, vec[...,np.newaxis])[...,0]
+
+    ret = np.empty( (inertias.shape[0], inertia_size) )
+    ret[:,inertia_mass] = mass
+    ret[:,inertia_com]  = com2
+    ret[:,4] =  tensor2[:,0,0]
+    ret[:,5] =  tensor2[:,1,1]
+    ret[:,6] =  tensor2[:,2,2]
+    ret[:,7] = -tensor2[:,0,1]
+    ret[:,8] = -tensor2[:,0,2]
+    ret[:,9] = -tensor2[:,1,2]
+    return ret
@@ -0,0 +1,134 @@
+import sys, time, json
+from collections import OrderedDict as ODict
+
+from urdf2kindsl import numeric
+
+try :
+    import tracemalloc
+except ImportError : # Python 2
+    tracemalloc = None
+
+
+stage_parse     = 'parse'
+stage_joints    = 'joint-frames'
+stage_inertia   = 'inertia'
+stage_prune     = 'prune'
+stage_serialize = 'serialize'
+# Additional stages of the incremental conversions of the watch mode
+stage_diff      = 'diff'
+stage_copy      = 'copy'
+stage_write     = 'write'
+
+counter_links_in   = 'links_in'
+counter_joints_in  = 'joints_in'
+counter_links_out  = 'links_out'
+counter_joints_out = 'joints_out'
+counter_pruned     = 'fixed_joints_pruned'
+counter_frames     = 'frames_moved'
+counter_lumped     = 'inertias_lumped'
+counter_singular   = numeric.counter_singular
+counter_joints_redone = 'joints_reconverted'
+counter_links_redone  = 'inertias_reconverted'
+
+
+class Stats :
+    '''Wall time and memory allocations of the stages of a conversion, and
+    counters of the relevant events.
+
+    Stages are measured with the `stage()` context manager; the memory is
+    measured only if `memory` is true, with tracemalloc, which slows down the
+    execution. The number of singular cases found by
+    `numeric.getIntrinsicXYZFromR()` is counted between `start()` and
+    `stop()`, which can be nested; only the outermost pair counts. The
+    outermost pair also starts and stops tracemalloc, unless it was already
+    tracing; a stage outside of any pair acts as one. The instance itself is a
+    context manager calling `start()` and `stop()`, also in case of errors.
+    '''
+    class _Stage :
+        def __init__(self, stats, name):
+            self.stats = stats
+            self.name  = name
+
+        def __enter__(self):
+            self.stats.start()
+            if self.stats.memory :
+                if hasattr(tracemalloc, 'reset_peak') :
+                    tracemalloc.reset_peak()
+                self.mem = tracemalloc.get_traced_memory()[0]
+            self.start = time.time()
+            return self
+
+        def __exit__(self, *args):
+            entry = self.stats.stages.setdefault(self.name, {'seconds' : 0.0})
+            entry['seconds'] += time.time() - self.start
+            if self.stats.memory :
+                (current, peak) = tracemalloc.get_traced_memory()
+                entry['allocated']   = entry.get('allocated', 0) + current - self.mem
+                entry['peak_memory'] = max(entry.get('peak_memory', 0), peak - self.mem)
+            self.stats.stop()
+            return False
+
+    def __init__(self, name=None, memory=False):
+        self.name   = name
+        self.memory = memory and (tracemalloc is not None)
+        self.stages   = ODict()
+        self.counters = ODict()
+        self.__depth    = 0
+        self.__singular = 0
+        self.__tracing  = False # whether tracemalloc was started by this instance
+
+    def start(self):
+        if self.__depth == 0 :
+            self.__singular = numeric.counters[numeric.counter_singular]
+            if self.memory and not tracemalloc.is_tracing() :
+                tracemalloc.start()
+                self.__tracing = True
+        self.__depth += 1
+
+    def stop(self):
+        self.__depth -= 1
+        if self.__depth == 0 :
+            self.count(counter_singular, numeric.counters[numeric.counter_singular] - self.__singular)
+            if self.__tracing :
+                tracemalloc.stop()
+                self.__tracing = False
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *args):
+        self.stop()
+        return False
+
+    def stage(self, name):
+        return Stats._Stage(self, name)
+
+    def count(self, name, n=1):
+        self.counters[name] = self.counters.get(name, 0) + n
+
+    def set(self, name, value):
+        self.counters[name] = value
+
+    def totalSeconds(self):
+        return sum( s['seconds'] for s in self.stages.values() )
+
+    def toDict(self):
+        return ODict( [('name', self.name), ('seconds', self.totalSeconds()),
+                       ('stages', self.stages), ('counters', self.counters)] )
+
+    def report(self, ofile=sys.stderr):
+        ofile.write('Conversion statistics' + ('' if self.name is None else ' for ' + self.name) + '\n')
+        for (name, s) in self.stages.items() :
+            line = '  {0:14s} {1:9.2f} ms'.format(name, s['seconds']*1000)
+            if 'peak_memory' in s :
+                line += '  {0:9.1f} KB allocated  {1:9.1f} KB peak'.format(s['allocated']/1024.0, s['peak_memory']/1024.0)
+            ofile.write(line + '\n')
+        ofile.write('  {0:14s} {1:9.2f} ms\n'.format('total', self.totalSeconds()*1000))
+        for (name, value) in self.counters.items() :
+            ofile.write('  {0:22s} {1}\n'.format(name, value))
+
+
+def writeJSON(statsList, ofile):
+    json.dump( [s.toDict() for s in statsList], ofile, indent=1 )
+    ofile.write('\n')
@@ -0,0 +1,214 @@
+'''
+Benchmark of the conversion stages (URDF parsing, conversion, serialization)
+on synthetic models of increasing size.
+
+Run it from the root of the repository with:
+
+    python -m urdf2kindsl.test.benchmark --output results.json
+
+and compare a later run against the stored results with:
+
+    python -m urdf2kindsl.test.benchmark --baseline results.json
+
+The exit status is non-zero if any stage got slower, or needed more memory,
+than the baseline by more than the given tolerances.
+'''
+import io, sys, gc, json, time, logging, argparse, platform
+import numpy as np
+
+from urdf2kindsl import urdf, convert, kindsl
+from urdf2kindsl.test import synthetic
+
+try :
+    import tracemalloc
+except ImportError : # Python 2
+    tracemalloc = None
+
+default_sizes = [20, 200, 2000, 20000]
+
+stage_parse   = 'parse'
+stage_convert = 'convert'
+stage_prune   = 'convert-prune'
+stage_lump    = 'convert-prune-lump'
+stage_serialize = 'serialize'
+
+_converterOptions = {
+    stage_convert : { convert.opt_key_prune : False },
+    stage_prune   : { convert.opt_key_prune : True, convert.opt_key_lumpi : False },
+    stage_lump    : { convert.opt_key_prune : True, convert.opt_key_lumpi : True }
+}
+
+
+def _measure(function, repeat, memory=True):
+    '''Best wall time of `repeat` runs, and peak memory of one additional run
+    (tracemalloc slows down the execution considerably). Returns also the
+    result of the last call
+    '''
+    best = None
+    for i in range(repeat) :
+        gc.collect()
+        start = time.time()
+        ret = function()
+        elapsed = time.time() - start
+        if best is None or elapsed < best :
+            best = elapsed
+    peak = None
+    if memory and tracemalloc is not None :
+        gc.collect()
+        tracemalloc.start()
+        function()
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    return (best, peak, ret)
+
+
+def benchmarkModel(data, repeat=3, memory=True):
+    '''Measures each stage on the given URDF document; returns a dictionary
+    stage -> (seconds, peak memory bytes)
+    '''
+    ret = {}
+    (t, mem, urdfin) = _measure( lambda : urdf.URDFWrapper(data), repeat, memory )
+    ret[stage_parse] = (t, mem)
+
+    converted = None
+    for stage in (stage_convert, stage_prune, stage_lump) :
+        opts = _converterOptions[stage]
+        (t, mem, conv) = _measure( lambda : convert.Converter(urdfin, dict(opts)), repeat, memory )
+        ret[stage] = (t, mem)
+        if stage == stage_convert :
+            converted = conv
+
+    def serialize() :
+        out = io.StringIO()
+        kindsl.Serializer(out).writeModel(converted)
+        return out
+    (t, mem, _) = _measure( serialize, repeat, memory )
+    ret[stage_serialize] = (t, mem)
+    return ret
+
+
+def run(models=None, sizes=None, repeat=3, seed=0, memory=True, log=None):
+    if models is None :
+        models = sorted(synthetic.generators.keys())
+    if sizes is None :
+        sizes = default_sizes
+    results = []
+    for model in models :
+        for size in sizes :
+            data = synthetic.generators[model](size, seed)
+            links = len( urdf.URDFWrapper(data).links )
+            stages = benchmarkModel(data, repeat, memory)
+            for stage in (stage_parse, stage_convert, stage_prune, stage_lump, stage_serialize) :
+                (t, mem) = stages[stage]
+                results.append( {
+                    'model' : model,
+                    'links' : links,
+                    'bytes' : len(data),
+                    'stage' : stage,
+                    'seconds' : t,
+                    'peak_memory' : mem
+                } )
+                if log is not None :
+                    log.write('{0:10s} {1:6d} {2:20s} {3:10.4f} s  {4}\n'.format(
+                        model, links, stage, t, _memstr(mem)))
+    return {
+        'info' : {
+            'python' : platform.python_version(),
+            'numpy'  : np.__version__,
+            'machine': platform.machine(),
+            'repeat' : repeat,
+            'seed'   : seed
+        },
+        'results' : results
+    }
+
+
+def _memstr(mem):
+    if mem is None :
+        return '-'
+    return '{0:.1f} MB'.format(mem / 1e6)
+
+
+def compare(current, baseline, tolerance=0.25, min_delta=0.005,
+            memory_tolerance=0.1, min_memory_delta=1e6, log=None):
+    '''Compares two sets of results. Returns the list of the regressions of
+    `current` with respect to `baseline`, as tuples (entry, metric, baseline
+    value), the metric being 'seconds' or 'peak_memory'.
+
+    A time is a regression if it exceeds the baseline by more than `tolerance`
+    (relative) and more than `min_delta` seconds; the absolute threshold
+    filters out the noise of the timing of the smallest models. The same
+    holds for the peak memory, with `memory_tolerance` and `min_memory_delta`
+    bytes, when both runs measured it.
+    '''
+    def key(r) :
+        return (r['model'], r['links'], r['stage'])
+    def ratio(value, base) :
+        return value / float(base) if base > 0 else 1.0
+    reference = dict( (key(r), r) for r in baseline['results'] )
+    regressions = []
+    for r in current['results'] :
+        base = reference.get( key(r) )
+        if base is None :
+            continue
+        flags = ''
+        tratio = ratio(r['seconds'], base['seconds'])
+        if tratio > 1.0 + tolerance and r['seconds'] - base['seconds'] > min_delta :
+            regressions.append( (r, 'seconds', base['seconds']) )
+            flags += '  SLOWER'
+        mratio = None
+        if r['peak_memory'] is not None and base['peak_memory'] is not None :
+            mratio = ratio(r['peak_memory'], base['peak_memory'])
+            if mratio > 1.0 + memory_tolerance and r['peak_memory'] - base['peak_memory'] > min_memory_delta :
+                regressions.append( (r, 'peak_memory', base['peak_memory']) )
+                flags += '  MORE MEMORY'
+        if log is not None :
+            log.write('{0:10s} {1:6d} {2:20s} {3:10.4f} s  x{4:5.2f}  {5:>9s}  {6}{7}\n'.format(
+                r['model'], r['links'], r['stage'], r['seconds'], tratio, _memstr(r['peak_memory']),
+                '-' if mratio is None else 'x{0:5.2f}'.format(mratio), flags))
+    return regressions
+
+
+def main():
+    argparser = argparse.ArgumentParser(
+        description='Benchmark the URDF to Kinematics-DSL conversion on synthetic models')
+    argparser.add_argument('--models', nargs='+', choices=sorted(synthetic.generators.keys()),
+            help='the synthetic models to use (defaults to all)')
+    argparser.add_argument('--sizes', nargs='+', type=int, default=default_sizes,
+            help='the number of links of the models (default: {0})'.format(default_sizes))
+    argparser.add_argument('--repeat', type=int, default=3,
+            help='number of runs of each stage; the best time is reported (default 3)')
+    argparser.add_argument('--no-memory', dest='memory', action='store_false',
+            help='do not measure the peak memory, which is slow')
+    argparser.add_argument('-o', '--output',
+            help='JSON file for the results')
+    argparser.add_argument('--baseline',
+            help='JSON file with previous results to compare against')
+    argparser.add_argument('--tolerance', type=float, default=0.25,
+            help='relative slowdown with respect to the baseline considered a regression (default 0.25)')
+    argparser.add_argument('--min-delta', type=float, default=0.005,
+            help='minimum absolute slowdown in seconds considered a regression (default 0.005)')
+    argparser.add_argument('--memory-tolerance', type=float, default=0.1,
+            help='relative increase of the peak memory with respect to the baseline considered a regression (default 0.1)')
+    argparser.add_argument('--min-memory-delta', type=float, default=1e6,
+            help='minimum absolute increase of the peak memory in bytes considered a regression (default 1e6)')
+    args = argparser.parse_args()
+
+    logging.basicConfig(level=logging.ERROR)
+    results = run(args.models, args.sizes, args.repeat, memory=args.memory, log=sys.stdout)
+    if args.output is not None :
+        with open(args.output, 'w') as f :
+            json.dump(results, f, indent=1)
+
+    if args.baseline is not None :
+        with open(args.baseline, 'r') as f :
+            baseline = json.load(f)
+        sys.stdout.write('\nComparison with ' + args.baseline + '\n')
+        regressions = compare(results, baseline, args.tolerance, args.min_delta,
+                              args.memory_tolerance, args.min_memory_delta, log=sys.stdout)
+        if len(regressions) > 0 :
+            sys.stdout.write('{0} regression(s)\n'.format(len(regressions)))
+            sys.exit(1)
+
+if __name__ == '__main__':
+    main()
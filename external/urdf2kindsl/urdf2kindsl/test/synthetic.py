@@ -0,0 +1,161 @@
+'''
+Generators of synthetic URDF models of arbitrary size, for testing and
+benchmarking. Each generator takes the approximate number of links and a
+seed, and returns the URDF document as bytes.
+'''
+import random
+
+# Angles and axes are chosen among "nice" values, typical of real robot
+# descriptions (multiples of PI/2 and small tilts)
+_angles = ['0', '0', '0', '1.570796', '-1.570796', '3.141593', '0.1', '-0.25']
+_axes   = ['1 0 0', '0 1 0', '0 0 1', '0 0 -1']
+
+
+class _Writer :
+    def __init__(self, name, seed):
+        self.rng = random.Random(seed)
+        self.parts = ['<robot name="' + name + '">\n']
+        self.links = 0
+
+    def link(self, name, mass=None, visual=True):
+        rng = self.rng
+        self.links += 1
+        self.parts.append('  <link name="' + name + '">\n')
+        if mass is not None :
+            self.parts.append(
+                '    <inertial>\n'
+                '      <origin xyz="{0:.4f} {1:.4f} {2:.4f}" rpy="0 0 0"/>\n'
+                '      <mass value="{3:.4f}"/>\n'
+                '      <inertia ixx="{4:.5f}" iyy="{5:.5f}" izz="{6:.5f}" ixy="{7:.6f}" ixz="{8:.6f}" iyz="{9:.6f}"/>\n'
+                '    </inertial>\n'.format(
+                    rng.uniform(-0.05,0.05), rng.uniform(-0.05,0.05), rng.uniform(-0.05,0.05), mass,
+                    rng.uniform(0.001,0.01), rng.uniform(0.001,0.01), rng.uniform(0.001,0.01),
+                    rng.uniform(-1e-4,1e-4), rng.uniform(-1e-4,1e-4), rng.uniform(-1e-4,1e-4)))
+        if visual :
+            # Ignored by the converter, but typical of real URDF files
+            for tag in ('visual', 'collision') :
+                self.parts.append(
+                    '    <' + tag + '>\n'
+                    '      <origin xyz="0 0 0" rpy="0 0 0"/>\n'
+                    '      <geometry> <mesh filename="package://robot/meshes/' + name + '.dae"/> </geometry>\n'
+                    '    </' + tag + '>\n')
+        self.parts.append('  </link>\n')
+
+    def joint(self, name, jtype, parent, child, rpy=None, axis=None):
+        rng = self.rng
+        if rpy is None :
+            rpy = ' '.join( rng.choice(_angles) for i in range(3) )
+        if axis is None :
+            axis = rng.choice(_axes)
+        xyz = '{0:.4f} {1:.4f} {2:.4f}'.format(rng.uniform(-0.3,0.3), rng.uniform(-0.3,0.3), rng.uniform(-0.3,0.3))
+        self.parts.append(
+            '  <joint name="' + name + '" type="' + jtype + '">\n'
+            '    <origin xyz="' + xyz + '" rpy="' + rpy + '"/>\n'
+            '    <parent link="' + parent + '"/>\n'
+            '    <child link="' + child + '"/>\n')
+        if jtype != 'fixed' :
+            self.parts.append(
+            '    <axis xyz="' + axis + '"/>\n'
+            '    <limit effort="80" velocity="10" lower="-3" upper="3"/>\n')
+        self.parts.append('  </joint>\n')
+
+    def extra(self, text):
+        self.parts.append(text)
+
+    def bytes(self):
+        self.parts.append('</robot>\n')
+        return ''.join(self.parts).encode('utf-8')
+
+
+def quadruped(links=20, seed=0):
+    '''A quadruped, with as many (fixed) sensor mounts as required to reach
+    the given number of links. Each mount is a chain of three fixed links
+    (mount, sensor, optical frame) attached to the base or to a leg
+    '''
+    w = _Writer('quadruped', seed)
+    w.link('base', mass=20.0)
+    w.link('base_inertia')
+    w.joint('base_to_base_inertia', 'fixed', 'base', 'base_inertia', rpy='0 0 0')
+    legLinks = []
+    for leg in ('LF', 'RF', 'LH', 'RH') :
+        names = [leg + '_HIP', leg + '_THIGH', leg + '_SHANK']
+        parent = 'base'
+        for (link, jname, axis) in zip(names, ('_HAA', '_HFE', '_KFE'), ('1 0 0', '0 1 0', '0 1 0')) :
+            w.link(link, mass=w.rng.uniform(0.5, 2.0))
+            w.joint(leg + jname, 'revolute', parent, link, rpy='0 0 0', axis=axis)
+            parent = link
+        w.link(leg + '_FOOT', mass=0.1)
+        w.joint(leg + '_SHANK_TO_FOOT', 'fixed', parent, leg + '_FOOT', rpy='0 0 0')
+        legLinks.extend(names)
+    w.link('imu_link')
+    w.joint('imu_joint', 'fixed', 'base', 'imu_link')
+
+    i = 0
+    while w.links < links :
+        parent = 'base' if i%2 == 0 else w.rng.choice(legLinks)
+        mount  = 'mount{0}'.format(i)
+        sensor = 'sensor{0}'.format(i)
+        optical= 'sensor{0}_optical'.format(i)
+        w.link(mount, mass=0.05)
+        w.joint(mount + '_joint', 'fixed', parent, mount)
+        w.link(sensor, mass=0.1)
+        w.joint(sensor + '_joint', 'fixed', mount, sensor)
+        w.link(optical, visual=False)
+        w.joint(optical + '_joint', 'fixed', sensor, optical, rpy='-1.570796 0 -1.570796')
+        w.extra('  <gazebo reference="' + sensor + '">\n    <sensor type="camera" name="' + sensor + '"> <update_rate>30</update_rate> </sensor>\n  </gazebo>\n')
+        i += 1
+    return w.bytes()
+
+
+def serialChain(links=20, seed=0):
+    '''A long serial chain of revolute joints about different axes, with a
+    prismatic joint every five joints
+    '''
+    w = _Writer('chain', seed)
+    w.link('link0', mass=1.0)
+    for i in range(1, links) :
+        name = 'link{0}'.format(i)
+        w.link(name, mass=w.rng.uniform(0.1, 1.0))
+        jtype = 'prismatic' if i%5 == 0 else 'revolute'
+        w.joint('joint{0}'.format(i), jtype, 'link{0}'.format(i-1), name)
+    return w.bytes()
+
+
+def wideTree(links=20, seed=0, fixedRatio=0.9):
+    '''A wide and shallow tree, whose joints are mostly fixed; the links are
+    listed in random order
+    '''
+    w = _Writer('tree', seed)
+    order = list(range(1, links))
+    w.rng.shuffle(order)
+    w.link('root', mass=5.0)
+    for i in order :
+        w.link('link{0}'.format(i), mass=w.rng.choice([None, 0.2]))
+    for i in range(1, links) :
+        parent = 'root' if i < 8 else 'link{0}'.format( w.rng.randrange(max(1, i//8), i) )
+        jtype = 'fixed' if w.rng.random() < fixedRatio else 'revolute'
+        w.joint('joint{0}'.format(i), jtype, parent, 'link{0}'.format(i))
+    return w.bytes()
+
+
+def mixedTree(links=20, seed=0):
+    '''A random tree with revolute, continuous, prismatic and fixed joints
+    about arbitrary axes
+    '''
+    w = _Writer('mixed', seed)
+    w.link('link0', mass=1.0)
+    for i in range(1, links) :
+        name = 'link{0}'.format(i)
+        w.link(name, mass=w.rng.choice([None, w.rng.uniform(0.1, 1.0)]))
+        parent = 'link{0}'.format( w.rng.randrange(max(0, i-4), i) )
+        jtype  = w.rng.choice(['revolute', 'continuous', 'prismatic', 'fixed'])
+        w.joint('joint{0}'.format(i), jtype, parent, name)
+    return w.bytes()
+
+
+generators = {
+    'quadruped' : quadruped,
+    'chain'     : serialChain,
+    'wide'      : wideTree,
+    'mixed'     : mixedTree
+}
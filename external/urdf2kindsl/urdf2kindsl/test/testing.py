@@ -1,7 +1,9 @@
-import os, io, difflib
+import os, io, difflib, shutil, tempfile
 import unittest
+import numpy as np
 
-from urdf2kindsl import urdf, kindsl, convert
+from urdf2kindsl import urdf, kindsl, convert, kinematics, batch, numeric, stats, verify, watch
+from urdf2kindsl.test import synthetic, benchmark
 
 thisDir = os.path.dirname(os.path.abspath(__file__))
 
@@ -15,6 +17,399 @@ class MiscTests(unittest.TestCase):
         convert.logger.disabled = False
 
 
+planarURDF = '''<robot name="planar">
+  <link name="base"/> <link name="l1"/> <link name="l2"/> <link name="tip"/>
+  <joint name="j1" type="revolute">
+    <parent link="base"/> <child link="l1"/> <axis xyz="0 0 1"/>
+  </joint>
+  <joint name="j2" type="prismatic">
+    <parent link="l1"/> <child link="l2"/>
+    <origin xyz="1 0 0"/> <axis xyz="1 0 0"/>
+  </joint>
+  <joint name="j3" type="fixed">
+    <parent link="l2"/> <child link="tip"/>
+    <origin xyz="0.5 0 0"/>
+  </joint>
+</robot>'''
+
+
+class BatchedNumericTests(unittest.TestCase):
+    rng = np.random.RandomState(0)
+    angles = np.vstack( [rng.uniform(-np.pi, np.pi, (200,3)),
+                         [[0.3, np.pi/2, 0.0], [0.3, -np.pi/2, 0.0], [0.0, 0.0, 0.0]]] )
+
+    def test_rotations(self):
+        Ri = numeric.batchR_intrinsicXYZ(self.angles)
+        Re = numeric.batchR_extrinsicXYZ(self.angles)
+        angles = numeric.batchIntrinsicXYZFromR(Ri)
+        for i, a in enumerate(self.angles) :
+            np.testing.assert_allclose(Ri[i], numeric.getR_intrinsicXYZ(*a), atol=1e-14)
+            np.testing.assert_allclose(Re[i], numeric.getR_extrinsicXYZ(*a), atol=1e-14)
+            np.testing.assert_allclose(angles[i], numeric.getIntrinsicXYZFromR(Ri[i]), atol=1e-12)
+
+    def test_near_singular(self):
+        # Round-off errors keep R[0,2] slightly below 1
+        R = numeric.getR_intrinsicXYZ(np.pi, np.pi/2, 0.0)
+        R[0,2] = 1.0 - 4e-16
+        np.testing.assert_allclose(numeric.getR_intrinsicXYZ(*numeric.getIntrinsicXYZFromR(R)), R, atol=1e-12)
+        np.testing.assert_allclose(numeric.batchIntrinsicXYZFromR(R[np.newaxis])[0], numeric.getIntrinsicXYZFromR(R))
+
+    def test_inertia(self):
+        n = len(self.angles)
+        R  = numeric.batchR_intrinsicXYZ(self.angles)
+        tr = self.rng.uniform(-1, 1, (n,3))
+        inertias = self.rng.uniform(-1, 1, (n,numeric.inertia_size))
+        out = numeric.batchRotoTranslateInertia(inertias, tr, R)
+        for i in range(n) :
+            expected = numeric.rotoTranslateInertia( numeric.inertiaFromArray(inertias[i]), tr[i], R[i])
+            np.testing.assert_array_equal(out[i], numeric.inertiaToArray(expected))
+
+    def test_arrays(self):
+        urdfin = urdf.URDFWrapper( os.path.join(thisDir, '03', 'anymal.urdf') )
+        converted = convert.Converter( urdfin, {convert.opt_key_prune : True} )
+        arrays = converted.toArrays()
+        self.assertEqual(len(arrays.linkNames), len(converted.links))
+        self.assertEqual(arrays.linkNames[0], converted.root.name)
+        for i, name in enumerate(arrays.linkNames) :
+            link = converted.links[name]
+            if i == 0 :
+                self.assertEqual(arrays.parents[i], -1)
+            else :
+                self.assertEqual(arrays.linkNames[arrays.parents[i]], link.parent.name)
+                np.testing.assert_array_equal(arrays.H[i], link.parentJ.frame.H)
+            self.assertEqual(arrays.inertia[i,numeric.inertia_mass], link.inertia['mass'])
+
+
+class ParserTests(unittest.TestCase):
+    def test_sources(self):
+        path = os.path.join(thisDir, '03', 'anymal.urdf')
+        with open(path, 'rb') as f :
+            data = f.read()
+        expected = urdf.URDFWrapper(path)
+        for source in [data, io.BytesIO(data)] :
+            parsed = urdf.URDFWrapper(source)
+            self.assertEqual(parsed.robotName, expected.robotName)
+            self.assertEqual(list(parsed.links.keys()), list(expected.links.keys()))
+            self.assertEqual(list(parsed.joints.keys()), list(expected.joints.keys()))
+            for name, link in expected.links.items() :
+                self.assertEqual(parsed.links[name].inertia, link.inertia)
+            for name, joint in expected.joints.items() :
+                other = parsed.joints[name]
+                self.assertEqual(other.frame, joint.frame)
+                self.assertEqual((other.type, other.parent, other.child), (joint.type, joint.parent, joint.child))
+
+    def test_joint_before_link(self):
+        doc = b'''<robot name="r">
+            <joint name="j" type="fixed"> <parent link="a"/> <child link="b"/> </joint>
+            <link name="a"> <visual> <geometry> <box size="1 1 1"/> </geometry> </visual> </link>
+            <gazebo reference="a"> <material>Gazebo/Grey</material> </gazebo>
+            <link name="b"/>
+        </robot>'''
+        parsed = urdf.URDFWrapper(doc)
+        self.assertIs(parsed.links['b'].parent, parsed.links['a'])
+        self.assertEqual(parsed.links['a'].inertia['mass'], 0.0)
+
+
+class ForwardKinematicsTests(unittest.TestCase):
+    def test_planar(self):
+        fk = kinematics.ForwardKinematics.fromURDF( urdf.URDFWrapper(io.StringIO(planarURDF)) )
+        self.assertEqual(fk.jointNames, ['j1', 'j2'])
+        q = np.array([[0.0, 0.0], [np.pi/2, 0.0], [np.pi/2, 1.0]])
+        tip = fk.poses(q, links=['tip'])[:,0,:3,3]
+        np.testing.assert_allclose(tip, [[1.5, 0, 0], [0, 1.5, 0], [0, 2.5, 0]], atol=1e-12)
+
+    def test_batch_matches_single(self):
+        urdfin = urdf.URDFWrapper( os.path.join(thisDir, '03', 'anymal.urdf') )
+        fk = kinematics.ForwardKinematics.fromURDF(urdfin)
+        q = np.random.RandomState(0).uniform(-np.pi, np.pi, (50, fk.jointCount()))
+        batch = fk.poses(q)
+        for i in range(q.shape[0]) :
+            np.testing.assert_allclose(batch[i], fk.poses(q[i])[0], atol=1e-12)
+
+        # At the zero configuration, the poses are just the chains of the
+        # constant joint transforms
+        zero = fk.poses( fk.zeroConfiguration() )[0]
+        for link in urdfin.links.values() :
+            H = np.identity(4)
+            current = link
+            while current.supportingJoint is not None :
+                H = np.matmul(current.supportingJoint.predec_H_joint, H)
+                current = current.parent
+            np.testing.assert_allclose(zero[fk.linkIndex(link.name)], H, atol=1e-12)
+
+
+class BatchConversionTests(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def test_cache(self):
+        inputs = [os.path.join(thisDir, '03', 'anymal.urdf')]
+        outDir = os.path.join(self.tmp, 'out')
+        cache  = os.path.join(self.tmp, 'cache')
+        settings = batch.defaultSettings()
+        settings[convert.opt_key_prune] = True
+
+        results = batch.convertMany(inputs, outDir, settings, cacheDir=cache, jobs=1)
+        self.assertEqual([r[2] for r in results], [False])
+        results = batch.convertMany(inputs, outDir, settings, cacheDir=cache, jobs=1)
+        self.assertEqual([r[2] for r in results], [True])
+
+        with open(os.path.join(thisDir, '03', 'anymal.kindsl'), 'r') as f :
+            expected = f.read()
+        with open(results[0][1], 'r') as f :
+            self.assertEqual(f.read(), expected)
+
+        # Different options, different cache entry
+        settings[convert.opt_key_prune] = False
+        results = batch.convertMany(inputs, outDir, settings, cacheDir=cache, jobs=1)
+        self.assertEqual([r[2] for r in results], [False])
+
+        # A different version of the tool, different cache entry
+        digest = batch.toolDigest()
+        try :
+            batch._toolDigest = 'changed'
+            results = batch.convertMany(inputs, outDir, settings, cacheDir=cache, jobs=1)
+            self.assertEqual([r[2] for r in results], [False])
+        finally :
+            batch._toolDigest = digest
+
+
+class StatsTests(unittest.TestCase):
+    def test_pruning_counters(self):
+        settings = batch.defaultSettings()
+        settings[convert.opt_key_prune] = True
+        out = io.StringIO()
+        st = batch.convertSource(os.path.join(thisDir, 'pruning', 'fixed_joints.urdf'), out, settings,
+                                 stats.Stats(memory=True))
+        if stats.tracemalloc is not None :
+            self.assertFalse(stats.tracemalloc.is_tracing())
+        with open(os.path.join(thisDir, 'pruning', 'pruned.kindsl'), 'r') as f :
+            self.assertEqual(out.getvalue(), f.read())
+
+        for stage in (stats.stage_parse, stats.stage_joints, stats.stage_inertia, stats.stage_prune, stats.stage_serialize) :
+            self.assertIn(stage, st.stages)
+            self.assertIn('peak_memory', st.stages[stage])
+        c = st.counters
+        self.assertEqual(c[stats.counter_links_in] - c[stats.counter_links_out], c[stats.counter_pruned])
+        self.assertEqual(c[stats.counter_joints_in] - c[stats.counter_joints_out], c[stats.counter_pruned])
+        self.assertEqual(c[stats.counter_pruned], 7)
+        self.assertEqual(c[stats.counter_frames], 7)
+        self.assertEqual(c[stats.counter_lumped], 3)
+        self.assertEqual(c[stats.counter_singular], 1)
+
+    @unittest.skipIf(stats.tracemalloc is None, 'tracemalloc not available')
+    def test_tracing_stopped(self):
+        conv = convert.Converter( urdf.URDFWrapper(os.path.join(thisDir, 'pruning', 'fixed_joints.urdf')) )
+        conv.stats = stats.Stats(memory=True)
+        conv.prune( {convert.opt_key_prune : True, convert.opt_key_toframes : True, convert.opt_key_lumpi : True} )
+        self.assertIn('peak_memory', conv.stats.stages[stats.stage_prune])
+        self.assertFalse(stats.tracemalloc.is_tracing())
+
+        # Also when the conversion fails
+        convert.logger.disabled = True
+        for source in [os.path.join(thisDir, 'no_root', 'dummy.urdf'), io.BytesIO(b'<robot')] :
+            self.assertRaises(Exception, batch.convertSource, source, io.StringIO(),
+                              batch.defaultSettings(), stats.Stats(memory=True))
+            self.assertFalse(stats.tracemalloc.is_tracing())
+        convert.logger.disabled = False
+
+        # Tracing started by someone else is left alone
+        stats.tracemalloc.start()
+        batch.convertSource(os.path.join(thisDir, 'pruning', 'fixed_joints.urdf'), io.StringIO(),
+                            batch.defaultSettings(), stats.Stats(memory=True))
+        self.assertTrue(stats.tracemalloc.is_tracing())
+        stats.tracemalloc.stop()
+
+    def test_converter(self):
+        # Without an explicit Stats, the converter keeps its own
+        conv = convert.Converter( urdf.URDFWrapper(os.path.join(thisDir, '03', 'anymal.urdf')) )
+        self.assertNotIn(stats.stage_prune, conv.stats.stages)
+        self.assertEqual(conv.stats.counters[stats.counter_pruned], 0)
+        self.assertEqual(conv.stats.counters[stats.counter_links_out], len(conv.links))
+
+
+class SerializerTests(unittest.TestCase):
+    def test_streaming(self):
+        urdfin    = urdf.URDFWrapper( os.path.join(thisDir, '03', 'anymal.urdf') )
+        converted = convert.Converter( urdfin, {convert.opt_key_prune : True} )
+        outputs = []
+        for streaming in [False, True] :
+            out = io.StringIO()
+            kindsl.Serializer(out, streaming=streaming).writeModel(converted)
+            outputs.append(out.getvalue())
+        self.assertEqual(outputs[0], outputs[1])
+
+    def test_long_chain(self):
+        n = 3000 # longer than the default recursion limit
+        doc = ['<robot name="chain"> <link name="l0"/>']
+        for i in range(1, n) :
+            doc.append('<link name="l{0}"/> <joint name="j{0}" type="revolute">'
+                '<parent link="l{1}"/> <child link="l{0}"/> <axis xyz="0 0 1"/> </joint>'.format(i, i-1))
+        doc.append('</robot>')
+        converted = convert.Converter( urdf.URDFWrapper(''.join(doc).encode()) )
+        out = io.StringIO()
+        kindsl.Serializer(out).writeModel(converted)
+        self.assertIn('link l{0} {{\n    id = {0}\n'.format(n-1), out.getvalue())
+
+
+class SyntheticModelsTests(unittest.TestCase):
+    def test_convert(self):
+        for (name, generator) in synthetic.generators.items() :
+            urdfin = urdf.URDFWrapper( generator(100) )
+            self.assertGreaterEqual(len(urdfin.links), 100)
+            for prune in [False, True] :
+                converted = convert.Converter( urdfin, {convert.opt_key_prune : prune} )
+                kindsl.Serializer( io.StringIO() ).writeModel(converted)
+
+    def test_benchmark(self):
+        results = benchmark.run(models=['quadruped'], sizes=[20], repeat=1)
+        self.assertEqual(len(results['results']), 5)
+        self.assertEqual(benchmark.compare(results, results), [])
+
+        # Same time, much more memory
+        worse = {'results' : [dict(r) for r in results['results']]}
+        worse['results'][0]['peak_memory'] = results['results'][0]['peak_memory'] + 1e7
+        regressions = benchmark.compare(worse, results)
+        self.assertEqual([(r[0]['stage'], r[1]) for r in regressions], [(benchmark.stage_parse, 'peak_memory')])
+
+
+class VerifyTests(unittest.TestCase):
+    models = [('01', 'ur5.urdf', 'ur5.kindsl'), ('02', 'ur5.urdf', 'ur5.kindsl'),
+              ('03', 'anymal.urdf', 'anymal.kindsl'), ('pruning', 'fixed_joints.urdf', 'pruned.kindsl')]
+
+    def test_parse(self):
+        with open(os.path.join(thisDir, 'pruning', 'pruned.kindsl'), 'r') as f :
+            doc = kindsl.parse(f)
+        self.assertEqual(doc.robotName, 'fixed_joints')
+        self.assertEqual(list(doc.links.keys()), ['base', 'leg', 'arm', 'finger'])
+        self.assertEqual(doc.links['arm'].children, [('finger', 'finger_joint')])
+        self.assertEqual(doc.joints['finger_joint'].type, 'prismatic')
+        self.assertEqual(doc.links['base'].frames['imu_link'], ((0.0, 0.0, 0.08), (-np.pi, 0.0, 0.0)))
+        self.assertEqual(doc.links['leg'].inertia['mass'], 1.5)
+
+    def test_expected_outputs(self):
+        for (subdir, urdfFile, kindslFile) in self.models :
+            report = verify.checkFiles(os.path.join(thisDir, subdir, urdfFile),
+                                       os.path.join(thisDir, subdir, kindslFile), samples=200)
+            self.assertEqual(report.failures(), [], subdir)
+            self.assertEqual(report.missing, [])
+
+    def test_detects_errors(self):
+        urdfin = urdf.URDFWrapper( os.path.join(thisDir, 'pruning', 'fixed_joints.urdf') )
+        with open(os.path.join(thisDir, 'pruning', 'pruned.kindsl'), 'r') as f :
+            text = f.read()
+        self.assertEqual(verify.check(urdfin, kindsl.parse(text), 100).failures(), [])
+
+        doc = kindsl.parse(text)
+        doc.joints['finger_joint'].rot = (0.0, 1.0708, 0.0)
+        doc.links['leg'].inertia['mass'] = 1.6
+        report = verify.check(urdfin, doc, 100)
+        failed = report.failures()
+        self.assertEqual(len(failed), 4)  # finger frame, mass, CoM, inertia
+        self.assertTrue(failed[0].startswith('frame finger'))
+        self.assertGreater(report.mass, 1e-3)
+
+
+class WatchTests(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.input  = os.path.join(self.tmp, 'robot.urdf')
+        self.output = os.path.join(self.tmp, 'robot.kindsl')
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def write(self, text):
+        with open(self.input, 'w') as f :
+            f.write(text)
+
+    def expected(self, settings):
+        out = io.StringIO()
+        batch.convertSource(self.input, out, settings)
+        return out.getvalue()
+
+    def generated(self):
+        with open(self.output, 'r') as f :
+            return f.read()
+
+    def test_diff(self):
+        text = synthetic.quadruped(40).decode('utf-8')
+        old = urdf.URDFWrapper(text.encode('utf-8'))
+        self.assertEqual(watch.diff(old, old), ([], []))
+        new = urdf.URDFWrapper(text.replace('axis xyz="0 1 0"', 'axis xyz="0 0 1"', 1).encode('utf-8'))
+        self.assertEqual(watch.diff(old, new), (['LF_HFE'], []))
+        new = urdf.URDFWrapper(text.replace('<mass value="0.1000"/>', '<mass value="0.2"/>', 1).encode('utf-8'))
+        self.assertEqual(watch.diff(old, new), ([], ['LF_FOOT']))
+        new = urdf.URDFWrapper(text.replace('<parent link="mount0"/>', '<parent link="base"/>', 1).encode('utf-8'))
+        self.assertEqual(watch.diff(old, new), None)
+
+    def test_incremental(self):
+        for prune in [False, True] :
+            settings = batch.defaultSettings()
+            settings[convert.opt_key_prune] = prune
+            text = synthetic.quadruped(40).decode('utf-8')
+            self.write(text)
+            model = watch.WarmModel(self.input, self.output, settings)
+            self.assertIsNotNone( model.refresh() )
+            self.assertIsNone( model.refresh() )
+
+            # The frame of the hip affects the whole leg
+            text = text.replace('axis xyz="1 0 0"', 'axis xyz="0 0 -1"', 1)
+            text = text.replace('<mass value="0.1000"/>', '<mass value="0.2"/>', 1)
+            self.write(text)
+            st = model.refresh()
+            # the joints are listed parent first; the changed link is in the leg
+            subtree = set([model.urdf.joints['LF_HAA'].child])
+            for joint in model.urdf.joints.values() :
+                if joint.parent in subtree :
+                    subtree.add(joint.child)
+            self.assertEqual(st.counters[stats.counter_joints_redone], len(subtree))
+            self.assertEqual(st.counters[stats.counter_links_redone], len(subtree))
+            self.assertEqual(self.generated(), self.expected(settings))
+
+            # Invalid content is skipped, the previous state is kept; the
+            # measurement of the failed conversion is closed anyway
+            self.write('<robot')
+            self.assertRaises(Exception, model.refresh, memory=True)
+            if stats.tracemalloc is not None :
+                self.assertFalse(stats.tracemalloc.is_tracing())
+            self.assertIsNone( model.refresh() )
+
+            # Structural change
+            text = text.replace('</robot>', '<link name="extra"/><joint name="extra_joint" type="fixed">'
+                                '<parent link="base"/><child link="extra"/></joint></robot>')
+            self.write(text)
+            st = model.refresh()
+            self.assertNotIn(stats.counter_joints_redone, st.counters)
+            self.assertEqual(self.generated(), self.expected(settings))
+
+
+    def test_child_first(self):
+        # The joint of a link listed before the joint of its parent
+        text = '''<robot name="reversed">
+          <link name="base"/> <link name="a"/> <link name="b"/>
+          <joint name="jb" type="revolute">
+            <parent link="a"/> <child link="b"/>
+            <origin xyz="0 0 1"/> <axis xyz="0 0 1"/>
+          </joint>
+          <joint name="ja" type="revolute">
+            <parent link="base"/> <child link="a"/>
+            <origin xyz="{0} 0 0"/> <axis xyz="1 0 0"/>
+          </joint>
+        </robot>'''
+        settings = batch.defaultSettings()
+        self.write(text.format(0))
+        model = watch.WarmModel(self.input, self.output, settings)
+        model.refresh()
+        self.write(text.format(1))
+        st = model.refresh()
+        self.assertEqual(st.counters[stats.counter_joints_redone], 2)
+        self.assertEqual(self.generated(), self.expected(settings))
+        urdfin = urdf.URDFWrapper(self.input)
+        self.assertEqual(verify.check(urdfin, kindsl.parse(self.generated()), 100).failures(), [])
+
+
 class CompareExpectedOutputTests(unittest.TestCase):
     defaultNumFormatter = kindsl.NumFormatter()
     differ = difflib.Differ()
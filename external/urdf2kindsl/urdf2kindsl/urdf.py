@@ -1,9 +1,9 @@
-import logging
+import io, logging
 import numpy as np
 import xml.etree.ElementTree as ET
 from collections import OrderedDict as ODict
 
-from urdf2kindsl import numeric
+from urdf2kindsl import numeric, kinematics
 
 logger = logging.getLogger(__name__)
 
@@ -11,12 +11,14 @@ class URDFWrapper :
     '''Representation of the original links and joints data, as found in a XML URDF
     '''
     class Link:
+        __slots__ = ('name', 'inertia', 'parent', 'supportingJoint')
         def __init__(self, name):
             self.name    = name
             self.inertia = None
             self.parent  = None
             self.supportingJoint = None
     class Joint:
+        __slots__ = ('name', 'type', 'frame', 'parent', 'child', 'predec_H_joint')
         def __init__(self, name):
             self.name = name
             self.type  = None
@@ -27,44 +29,88 @@ class URDFWrapper :
 
     iMomentsLabels = ['ixx', 'iyy', 'izz', 'ixy', 'ixz', 'iyz']
 
-    def __init__(self, urdfInFile):
-        root = ET.parse(urdfInFile)
-        self.robotName = root.getroot().get('name')
+    # The only sub-elements of <link> and <joint> used by the converter; all
+    # the others (visual, collision, etc.) are discarded while parsing
+    linkChildTags  = ('inertial',)
+    jointChildTags = ('origin', 'axis', 'parent', 'child')
 
-        linkNodes  = root.findall("link")
-        jointNodes = root.findall("joint")
+    def __init__(self, urdfIn):
+        '''Parses the given URDF, which can be a file path, a file object or a
+        buffer of bytes (e.g. the output of xacro).
 
+        The document is read incrementally: the elements that are not required
+        are dropped as soon as they are complete, so the memory footprint does
+        not depend on the size of the visual, collision, gazebo, etc. sections.
+        '''
+        if isinstance(urdfIn, (bytes, bytearray)) and not isinstance(urdfIn, str) :
+            urdfIn = io.BytesIO(urdfIn)
+
+        self.robotName = None
         self.links  = ODict()
         self.joints = ODict()
         self.frames = ODict()
 
-        for nodelink in linkNodes:
-            name = nodelink.get('name')
-            link = URDFWrapper.Link( name )
-            link.inertia = self.readInertialData(nodelink)
-            self.links[name] = link
-
-        for nodejoint in jointNodes:
-            name = nodejoint.get('name')
-            joint = URDFWrapper.Joint( name )
-            joint.type  = nodejoint.get('type')
-            joint.frame = self.readJointFrameData( nodejoint )
-            joint.predec_H_joint[:3,:3] = numeric.getR_extrinsicXYZ( * joint.frame['rpy'] )
-            joint.predec_H_joint[:3,3]  = np.array( joint.frame['xyz'] )
-            joint.parent= nodejoint.find('parent').get('link')
-            joint.child = nodejoint.find('child').get('link')
-
-            # Note I keep URDF nomenclature ("parent" and "child") just to
-            # stress the bond with the source URDF XML file. I will later use
-            # the more appropriate terms (e.g. "predecessor")
-
-            self.joints[name] = joint
-
+        # Stack of the currently open elements; stack[0] is <robot>
+        stack = []
+        for event, node in ET.iterparse(urdfIn, events=('start', 'end')) :
+            if event == 'start' :
+                if len(stack) == 0 :
+                    self.robotName = node.get('name')
+                stack.append(node)
+                continue
+
+            stack.pop()
+            depth = len(stack)
+            if depth == 0 :
+                node.clear()
+            elif depth == 1 :
+                if node.tag == 'link' :
+                    self.addLink(node)
+                elif node.tag == 'joint' :
+                    self.addJoint(node)
+                stack[0].remove(node)
+            else :
+                top = stack[1]
+                keep = False
+                if depth > 2 :
+                    keep = top.tag in ('link', 'joint')  # the parent was kept
+                elif top.tag == 'link' :
+                    keep = node.tag in URDFWrapper.linkChildTags
+                elif top.tag == 'joint' :
+                    keep = node.tag in URDFWrapper.jointChildTags
+                if not keep :
+                    stack[-1].remove(node)
+
+        # Links may appear after the joints referencing them, thus connect
+        # the tree only at the end
+        for joint in self.joints.values() :
             predecessor = self.links[ joint.parent ]
             successor   = self.links[ joint.child ]
             successor.parent = predecessor # a Link instance, not a name
             successor.supportingJoint = joint
 
+    def addLink(self, nodelink):
+        name = nodelink.get('name')
+        link = URDFWrapper.Link( name )
+        link.inertia = self.readInertialData(nodelink)
+        self.links[name] = link
+
+    def addJoint(self, nodejoint):
+        name = nodejoint.get('name')
+        joint = URDFWrapper.Joint( name )
+        joint.type  = nodejoint.get('type')
+        joint.frame = self.readJointFrameData( nodejoint )
+        joint.predec_H_joint[:3,:3] = numeric.getR_extrinsicXYZ( * joint.frame['rpy'] )
+        joint.predec_H_joint[:3,3]  = np.array( joint.frame['xyz'] )
+        joint.parent= nodejoint.find('parent').get('link')
+        joint.child = nodejoint.find('child').get('link')
+
+        # Note I keep URDF nomenclature ("parent" and "child") just to
+        # stress the bond with the source URDF XML file. I will later use
+        # the more appropriate terms (e.g. "predecessor")
+
+        self.joints[name] = joint
+
     def readInertialData(self, linkNode):
         params = dict()
         paramsNode = linkNode.find('inertial')
@@ -127,17 +173,16 @@ class URDFWrapper :
         return params
 
 
-def linkOrigin(urdf, eelinkname):
-    logger.debug("Entering urdfdbg_linkOrigin() function ...")
-    H = np.identity(4)
-
-    currentLink  = urdf.links[eelinkname]
-    while currentLink is not None :
-        currentJoint = currentLink.supportingJoint
-        logger.debug("Link : " + currentLink.name)
-        if currentJoint is not None :
-            logger.debug("Joint: " + currentJoint.name)
-            H = np.matmul( currentJoint.predec_H_joint , H )
-        currentLink  = currentLink.parent
+def linkOrigin(urdf, eelinkname, q=None):
+    '''Print the origin of the frame of the given link, in base coordinates.
 
+    The joint configuration `q` defaults to the zero configuration; see
+    `kinematics.ForwardKinematics` for the batched computation of all the
+    link poses.
+    '''
+    fk = kinematics.ForwardKinematics.fromURDF(urdf)
+    if q is None :
+        q = fk.zeroConfiguration()
+    H = fk.poses(q, links=[eelinkname])[0,0]
     print( np.round(H[:3,3], 5) )
+    return H
@@ -0,0 +1,294 @@
+'''
+Round-trip check of the conversion. The Kinematics-DSL document is read back,
+and compared with the source URDF model on many random joint configurations:
+
+  - the pose of every URDF link, which in the Kinematics-DSL model is either
+    a link (possibly with the 'urdf_<link>' frame) or a user frame, if the
+    link was pruned
+  - the total mass, and the composite center of mass and inertia of the
+    whole robot, in base coordinates
+
+All the configurations are evaluated at once with the batched forward
+kinematics. Run it from the root of the repository with:
+
+    python -m urdf2kindsl.verify robot.urdf robot.kindsl
+
+The exit status is non-zero if any error exceeds the tolerance.
+'''
+import sys, math, logging, argparse
+from collections import OrderedDict as ODict
+import numpy as np
+
+from urdf2kindsl import urdf, convert, kindsl, kinematics, numeric
+
+logger = logging.getLogger(__name__)
+
+default_samples   = 1000
+default_tolerance = 1e-4
+
+# Upper bound for the number of link poses computed at once, to limit the
+# memory usage for big models
+max_batch_poses = 1 << 18
+
+
+def frameH(tr, rot):
+    '''The homogeneous transform of a Kinematics-DSL frame'''
+    H = np.identity(4)
+    H[:3,:3] = numeric.getR_intrinsicXYZ(*rot)
+    H[:3,3]  = tr
+    return H
+
+
+def documentKinematics(doc, jointNames):
+    '''The ForwardKinematics of a parsed Kinematics-DSL document.
+
+    `jointNames` is the order of the joints in the joint-status arrays. All
+    the joints move along the Z axis of their reference frame. The joints
+    not in `jointNames` are held at zero, as fixed joints; this is the case
+    of the fixed URDF joints which were not pruned.
+    '''
+    linkNames = list(doc.links.keys())
+    index = { name : i for i, name in enumerate(linkNames) }
+    column = { name : i for i, name in enumerate(jointNames) }
+    n = len(linkNames)
+
+    parents = np.full(n, -1, dtype=int)
+    parent_H_joint = np.tile( np.identity(4), (n,1,1) )
+    jtypes = np.zeros(n, dtype=int)
+    qIndex = np.full(n, -1, dtype=int)
+    for link in doc.links.values() :
+        for (child, jname) in link.children :
+            if child not in index or jname not in doc.joints :
+                raise ValueError("Undefined child '{0}' or joint '{1}' of link '{2}'".format(child, jname, link.name))
+            i = index[child]
+            joint = doc.joints[jname]
+            parents[i] = index[link.name]
+            parent_H_joint[i] = frameH(joint.tr, joint.rot)
+            if jname in column :
+                jtypes[i] = kinematics.jtype_prismatic if joint.type == 'prismatic' else kinematics.jtype_revolute
+                qIndex[i] = column[jname]
+    axes = np.tile( np.array([0.0,0.0,1.0]), (n,1) )
+    return kinematics.ForwardKinematics(linkNames, parents, parent_H_joint, jtypes, axes, qIndex, jointNames)
+
+
+def _inertiaTensor(Ixx, Iyy, Izz, Ixy, Ixz, Iyz):
+    return np.array( [[Ixx, Ixy, Ixz],
+                      [Ixy, Iyy, Iyz],
+                      [Ixz, Iyz, Izz]] )
+
+def urdfInertia(urdfin, linkNames):
+    '''Mass, CoM and inertia tensor about the CoM of the given URDF links,
+    in link coordinates, as (n,) (n,3) (n,3,3) arrays
+    '''
+    n = len(linkNames)
+    mass = np.zeros(n)
+    com  = np.zeros( (n,3) )
+    Ic   = np.zeros( (n,3,3) )
+    for (i, name) in enumerate(linkNames) :
+        p = urdfin.links[name].inertia
+        mass[i] = p['mass']
+        com[i]  = p['xyz']
+        Ic[i]   = _inertiaTensor(p['ixx'], p['iyy'], p['izz'], p['ixy'], p['ixz'], p['iyz'])
+    return (mass, com, Ic)
+
+def documentInertia(doc):
+    '''Mass, CoM and inertia tensor about the CoM of the links of a parsed
+    Kinematics-DSL document. The document has the moments of inertia about
+    the link origin, with the opposite sign for the products of inertia.
+    '''
+    n = len(doc.links)
+    mass = np.zeros(n)
+    com  = np.zeros( (n,3) )
+    Ic   = np.zeros( (n,3,3) )
+    for (i, link) in enumerate(doc.links.values()) :
+        p = link.inertia
+        m = p.get('mass', 0.0)
+        c = np.asarray( p.get('com', (0.0,0.0,0.0)) )
+        Io = _inertiaTensor(p.get('Ix',0.0), p.get('Iy',0.0), p.get('Iz',0.0),
+                           -p.get('Ixy',0.0), -p.get('Ixz',0.0), -p.get('Iyz',0.0))
+        mass[i] = m
+        com[i]  = c
+        Ic[i]   = Io - m * (np.dot(c,c)*np.identity(3) - np.outer(c,c))
+    return (mass, com, Ic)
+
+
+def composite(H, mass, com, Ic):
+    '''The composite CoM and inertia tensor (about the composite CoM) of the
+    links with poses `H` (N,n,4,4), in base coordinates; (N,3) and (N,3,3)
+    arrays. `mass` must not sum to zero.
+    '''
+    R = H[..., :3, :3]
+    comw = np.matmul( R, com[..., np.newaxis] )[..., 0] + H[..., :3, 3]
+    total = mass.sum()
+    C = np.einsum('k,nki->ni', mass, comw) / total
+    I = np.matmul( np.matmul(R, Ic), np.swapaxes(R, -1, -2) ).sum(axis=1)
+    d = comw - C[:, np.newaxis]
+    dd = np.einsum('k,nki,nki->n', mass, d, d)
+    I += dd[:, np.newaxis, np.newaxis] * np.identity(3) - np.einsum('k,nki,nkj->nij', mass, d, d)
+    return (C, I)
+
+
+class Report :
+    '''The outcome of a round-trip check.
+
+    `frames` maps the name of each URDF link to the maximum position and
+    rotation errors of its pose, over all the configurations. `missing`
+    lists the URDF links not found in the document (e.g. links pruned
+    without conversion to frames), `heldJoints` the joints of the document
+    which are not movable joints in the URDF, held at zero. The mass error
+    is relative, the CoM error absolute, the inertia error relative to the
+    largest element of the composite inertia; they are None if the inertia
+    was not checked.
+    '''
+    def __init__(self, samples):
+        self.samples = samples
+        self.frames  = ODict()
+        self.missing = []
+        self.heldJoints = []
+        self.mass    = None
+        self.com     = None
+        self.inertia = None
+
+    def maxPositionError(self):
+        return max( [e[0] for e in self.frames.values()] + [0.0] )
+
+    def maxRotationError(self):
+        return max( [e[1] for e in self.frames.values()] + [0.0] )
+
+    def failures(self, tolerance=default_tolerance):
+        '''The descriptions of the errors exceeding the tolerance'''
+        ret = []
+        for (name, (pos, rot)) in self.frames.items() :
+            if pos > tolerance or rot > tolerance :
+                ret.append("frame {0}: position error {1:.3g}, rotation error {2:.3g}".format(name, pos, rot))
+        for (label, err) in (('mass', self.mass), ('CoM', self.com), ('inertia', self.inertia)) :
+            if err is not None and err > tolerance :
+                ret.append("{0} error {1:.3g}".format(label, err))
+        return ret
+
+    def write(self, ofile=sys.stdout, verbose=False):
+        ofile.write('Round-trip check on {0} configurations\n'.format(self.samples))
+        if verbose :
+            for (name, (pos, rot)) in self.frames.items() :
+                ofile.write('  {0:30s} {1:10.3g} m  {2:10.3g} rad\n'.format(name, pos, rot))
+        ofile.write('  max position error {0:.3g} m, max rotation error {1:.3g} rad, over {2} frames\n'.format(
+            self.maxPositionError(), self.maxRotationError(), len(self.frames)))
+        if self.mass is not None :
+            ofile.write('  mass error {0:.3g}, CoM error {1:.3g} m, inertia error {2:.3g}\n'.format(
+                self.mass, self.com, self.inertia))
+        if len(self.missing) > 0 :
+            ofile.write('  not in the document: ' + ', '.join(self.missing) + '\n')
+        if len(self.heldJoints) > 0 :
+            ofile.write('  held at zero: ' + ', '.join(self.heldJoints) + '\n')
+
+
+def check(urdfin, doc, samples=default_samples, seed=0, inertia=True):
+    '''Compares the URDFWrapper model `urdfin` with the Kinematics-DSL
+    Document `doc` (see `kindsl.parse()`) on `samples` random joint
+    configurations. Returns a Report.
+    '''
+    urdfFK = kinematics.ForwardKinematics.fromURDF(urdfin)
+    jointNames = [convert.Converter.toValidID(j) for j in urdfFK.jointNames]
+    docFK = documentKinematics(doc, jointNames)
+
+    # Where each URDF link is in the document: the index of a link, and the
+    # transform from the frame of the URDF link to the link frame
+    urdfIdx  = []
+    docIdx   = []
+    docLocal = []
+    owners = {}
+    for link in doc.links.values() :
+        for fname in link.frames.keys() :
+            owners[fname] = link
+    report = Report(samples)
+    report.heldJoints = [j for j in doc.joints.keys() if j not in jointNames]
+    for (i, name) in enumerate(urdfFK.linkNames) :
+        vname = convert.Converter.toValidID(name)
+        if vname in doc.links :
+            local = doc.links[vname].frames.get('urdf_' + vname)
+            owner = vname
+        elif vname in owners :
+            local = owners[vname].frames[vname]
+            owner = owners[vname].name
+        else :
+            report.missing.append(vname)
+            continue
+        urdfIdx.append(i)
+        docIdx.append( docFK.linkIndex(owner) )
+        docLocal.append( np.identity(4) if local is None else frameH(*local) )
+    docLocal = np.array(docLocal).reshape( (len(docIdx),4,4) )
+
+    if inertia :
+        (umass, ucom, uIc) = urdfInertia(urdfin, urdfFK.linkNames)
+        (dmass, dcom, dIc) = documentInertia(doc)
+        total = umass.sum()
+        report.mass = abs(dmass.sum() - total) / (total if total > 0 else 1.0)
+        inertia = total > 0 and dmass.sum() > 0
+        if inertia :
+            report.com = 0.0
+            report.inertia = 0.0
+
+    rng = np.random.RandomState(seed)
+    q = rng.uniform(-math.pi, math.pi, (samples, urdfFK.jointCount()))
+    q[0] = 0.0
+    posErr = np.zeros(len(urdfIdx))
+    rotErr = np.zeros(len(urdfIdx))
+    chunk = max(1, max_batch_poses // max(len(urdfFK.linkNames), len(docFK.linkNames), 1))
+    for start in range(0, samples, chunk) :
+        qc = q[start:start+chunk]
+        Hu = urdfFK.poses(qc)
+        Hd = docFK.poses(qc)
+        A = Hu[:, urdfIdx]
+        B = np.matmul( Hd[:, docIdx], docLocal )
+        posErr = np.maximum( posErr, np.linalg.norm(A[...,:3,3] - B[...,:3,3], axis=-1).max(axis=0) )
+        # The rotation angle between the two orientations, from the Frobenius
+        # norm of the difference: |Ra - Rb| = 2 sqrt(2) sin(angle/2)
+        d = np.linalg.norm( (A[...,:3,:3] - B[...,:3,:3]).reshape(A.shape[:2] + (9,)), axis=-1 )
+        rotErr = np.maximum( rotErr, 2*np.arcsin( np.minimum(d / (2*math.sqrt(2)), 1.0) ).max(axis=0) )
+
+        if inertia :
+            (Cu, Iu) = composite(Hu, umass, ucom, uIc)
+            (Cd, Id) = composite(Hd, dmass, dcom, dIc)
+            report.com = max( report.com, np.linalg.norm(Cu - Cd, axis=-1).max() )
+            scale = np.abs(Iu).max(axis=(1,2))
+            scale[scale == 0] = 1.0
+            report.inertia = max( report.inertia, (np.abs(Iu - Id).max(axis=(1,2)) / scale).max() )
+
+    for (k, i) in enumerate(urdfIdx) :
+        report.frames[ convert.Converter.toValidID(urdfFK.linkNames[i]) ] = (posErr[k], rotErr[k])
+    return report
+
+
+def checkFiles(urdfSource, kindslPath, samples=default_samples, seed=0, inertia=True):
+    '''Like `check()`, reading the models from the given files'''
+    with open(kindslPath, 'r') as f :
+        doc = kindsl.parse(f)
+    return check(urdf.URDFWrapper(urdfSource), doc, samples, seed, inertia)
+
+
+def main():
+    argparser = argparse.ArgumentParser(
+        description='Check that a Kinematics-DSL model is equivalent to the URDF model it was generated from')
+    argparser.add_argument('urdf', metavar='URDF-input', help='path of the URDF file')
+    argparser.add_argument('kindsl', metavar='KINDSL-input', help='path of the Kinematics-DSL file')
+    argparser.add_argument('--samples', type=int, default=default_samples,
+            help='number of random joint configurations (default {0})'.format(default_samples))
+    argparser.add_argument('--seed', type=int, default=0, help='seed of the random configurations')
+    argparser.add_argument('--tolerance', type=float, default=default_tolerance,
+            help='maximum acceptable error (default {0})'.format(default_tolerance))
+    argparser.add_argument('--no-inertia', dest='inertia', action='store_false',
+            help='do not compare the inertia, e.g. when pruned links were not lumped')
+    argparser.add_argument('-v', '--verbose', action='store_true', help='print the error of every frame')
+    args = argparser.parse_args()
+
+    logging.basicConfig(level=logging.ERROR)
+    report = checkFiles(args.urdf, args.kindsl, args.samples, args.seed, args.inertia)
+    report.write(sys.stdout, args.verbose)
+    failures = report.failures(args.tolerance)
+    for f in failures :
+        sys.stdout.write('ERROR ' + f + '\n')
+    if len(failures) > 0 :
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,175 @@
+import io, os, time, logging
+
+from urdf2kindsl import urdf, convert, kindsl, batch
+from urdf2kindsl import stats as statistics
+
+logger = logging.getLogger(__name__)
+
+'''
+Watch mode: the URDF files are converted again whenever they change, by a
+long-running process that keeps the models in memory.
+
+For each file, the last parsed URDF model and its conversion without pruning
+are kept. When the file changes, the new URDF model is compared with the
+previous one; if only the joint frames and the inertia parameters changed,
+only the affected subtrees are converted again (see `Converter.update()`).
+Pruning and inertia lumping run on a copy of the updated model, as they are
+linear in its size. Any change in the structure of the model (links or joints
+added, removed, renamed, or moved in the tree) leads to a full conversion.
+'''
+
+default_interval = 0.2 # seconds
+
+# A file modified less than this number of seconds ago may be modified again
+# without any visible change of its time stamp, because of its resolution
+racy_interval = 2.0
+
+
+def diff(old, new):
+    '''The names of the joints and of the links of the URDFWrapper `new`
+    whose data differ from `old`, as two lists; None if the two models do not
+    have the same links and joints, in the same order, connected the same way
+    '''
+    if list(old.links.keys()) != list(new.links.keys()) or list(old.joints.keys()) != list(new.joints.keys()) :
+        return None
+    joints = []
+    for (name, joint) in new.joints.items() :
+        prev = old.joints[name]
+        if (prev.parent, prev.child) != (joint.parent, joint.child) :
+            return None
+        if prev.type != joint.type or prev.frame != joint.frame :
+            joints.append(name)
+    links = [name for (name, link) in new.links.items() if link.inertia != old.links[name].inertia]
+    return (joints, links)
+
+
+class WarmModel :
+    '''A URDF file with its current conversion, kept in memory and updated
+    incrementally when the file changes
+    '''
+    def __init__(self, urdfPath, outPath, settings):
+        self.urdfPath = urdfPath
+        self.outPath  = outPath
+        self.settings = settings
+        self.signature = None # modification time and size of the file
+        self.data  = None
+        self.rejected = None  # the content that could not be converted
+        self.urdf  = None
+        self.model = None     # the conversion without pruning
+
+    def _signature(self):
+        st = os.stat(self.urdfPath)
+        signature = (getattr(st, 'st_mtime_ns', st.st_mtime), st.st_size)
+        # Like git does with racily clean files, do not trust the signature
+        # of a recently modified file; its content is compared instead
+        trusted = time.time() - st.st_mtime > racy_interval
+        return (signature, trusted)
+
+    def refresh(self, force=False, memory=False):
+        '''Converts the file again if it changed since the last call (or if
+        `force` is true), and writes the output. Returns the Stats of the
+        conversion, or None if nothing was done.
+        '''
+        start = time.time()
+        (signature, trusted) = self._signature()
+        if signature == self.signature and not force :
+            return None
+        self.signature = signature if trusted else None
+        with open(self.urdfPath, 'rb') as f :
+            data = f.read()
+        if (data == self.data or data == self.rejected) and not force :
+            return None
+        # Cleared only if the conversion succeeds
+        self.rejected = data
+
+        stats = statistics.Stats(name=self.urdfPath, memory=memory)
+        with stats :
+            with stats.stage(statistics.stage_parse) :
+                urdfin = urdf.URDFWrapper(data)
+
+            changes = None
+            if self.model is not None :
+                with stats.stage(statistics.stage_diff) :
+                    changes = diff(self.urdf, urdfin)
+            if changes is None :
+                model = convert.Converter( urdfin, {convert.opt_key_prune : False}, stats )
+            else :
+                model = self.model
+                model.stats = stats
+                try :
+                    model.update(urdfin, *changes)
+                except Exception :
+                    # The model might be inconsistent, start again next time
+                    self.model = None
+                    raise
+            # Commit to the new state only after a successful conversion
+            self.data  = data
+            self.urdf  = urdfin
+            self.model = model
+
+            converted = model
+            if self.settings[convert.opt_key_prune] :
+                with stats.stage(statistics.stage_copy) :
+                    converted = model.copy(stats)
+                converted.prune( {
+                    convert.opt_key_prune    : True,
+                    convert.opt_key_toframes : self.settings[convert.opt_key_toframes],
+                    convert.opt_key_lumpi    : self.settings[convert.opt_key_lumpi] } )
+
+            text = io.StringIO()
+            form = kindsl.NumFormatter( round_digits=self.settings[batch.key_digits], pi_round_digits=self.settings[batch.key_pi_digits])
+            ser  = kindsl.Serializer(text, numFormatter=form, floating=self.settings[batch.key_floating])
+            with stats.stage(statistics.stage_serialize) :
+                ser.writeModel(converted)
+            with stats.stage(statistics.stage_write) :
+                batch.writeAtomically(self.outPath, text.getvalue())
+            self.rejected = None
+
+        # The wall time of the whole update, including the file checks
+        elapsed = (time.time() - start) * 1000
+        if changes is None :
+            logger.info("Converted '{0}' in {1:.1f} ms".format(self.urdfPath, elapsed))
+        else :
+            logger.info("Updated '{0}' in {1:.1f} ms ({2} joints and {3} links changed)".format(
+                self.urdfPath, elapsed, len(changes[0]), len(changes[1])))
+        return stats
+
+
+class Watcher :
+    '''Polls the given URDF files, converting each one again when it changes.
+
+    `pairs` is a list of (URDF path, output path) tuples. A file which cannot
+    be converted (e.g. invalid XML, because it is still being written) is
+    reported, and tried again at its next change.
+    '''
+    def __init__(self, pairs, settings):
+        self.models = [WarmModel(urdfPath, outPath, settings) for (urdfPath, outPath) in pairs]
+
+    def poll(self, memory=False):
+        '''Checks all the files once; returns the list of the Stats of the
+        conversions performed
+        '''
+        ret = []
+        for model in self.models :
+            try :
+                stats = model.refresh(memory=memory)
+            except Exception as e :
+                logger.error("Could not convert '{0}': {1}".format(model.urdfPath, e))
+                continue
+            if stats is not None :
+                ret.append(stats)
+        return ret
+
+    def run(self, interval=default_interval, callback=None, memory=False):
+        '''Polls the files every `interval` seconds, until interrupted. The
+        Stats of each conversion are passed to `callback`, if given
+        '''
+        logger.info("Watching {0} file(s)".format(len(self.models)))
+        try :
+            while True :
+                for stats in self.poll(memory) :
+                    if callback is not None :
+                        callback(stats)
+                time.sleep(interval)
+        except KeyboardInterrupt :
+            pass
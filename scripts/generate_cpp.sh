@@ -48,13 +48,14 @@ ROBCOGEN_DIR=${QUADRUPED_DIR}/external/robcogen
 # remove previously generated header files
 rm -f ${ROBOT_DIR}/include/${ROBOT_NAME}_robcogen/*
 
-# generate the ${ROBOT_NAME} URDF from xacro
-echo "Generating \"${ROBOT_NAME}.urdf\" from \"${ROBOT_XACRO_NAME}.urdf.xacro\" ..."
-xacro $(rospack find ${ROBOT_DESCRIPTION_PKG_NAME})/urdf/${ROBOT_XACRO_NAME}.urdf.xacro ${XACRO_ARGS} > ${ROBOT_DIR}/config/${ROBOT_NAME}.urdf
-
-# generate the RobCoGen robot model files from the URDF
-echo "Generating \"${ROBOT_NAME}.kindsl\" from \"${ROBOT_NAME}.urdf\" ... "
-${QUADRUPED_DIR}/external/urdf2kindsl/urdf2kindsl.py --prune-fixed-joints --lump-inertia --floating -o ${ROBOT_DIR}/config/${ROBOT_NAME}.kindsl ${ROBOT_DIR}/config/${ROBOT_NAME}.urdf
+# generate the ${ROBOT_NAME} URDF from xacro, and the RobCoGen robot model files
+# from the URDF; the URDF is piped directly into the converter, and a failure
+# of either command must stop the script
+set -o pipefail
+echo "Generating \"${ROBOT_NAME}.kindsl\" from \"${ROBOT_XACRO_NAME}.urdf.xacro\" ..."
+xacro $(rospack find ${ROBOT_DESCRIPTION_PKG_NAME})/urdf/${ROBOT_XACRO_NAME}.urdf.xacro ${XACRO_ARGS} | \
+    ${QUADRUPED_DIR}/external/urdf2kindsl/urdf2kindsl.py --prune-fixed-joints --lump-inertia --floating --verify -o ${ROBOT_DIR}/config/${ROBOT_NAME}.kindsl - \
+    || { echo "ERROR: the generation of \"${ROBOT_NAME}.kindsl\" failed. Exiting ..."; exit 1; }
 
 # generate the C++ code inside the /tmp/gen system folder
 echo "Generating code from \"${ROBOT_NAME}.kindsl\" ..."
@@ -68,9 +69,8 @@ mkdir -p ${ROBOT_DIR}/src/
 cp /tmp/gen/cpp/*.h ${ROBOT_DIR}/include/${ROBOT_NAME}_robcogen/
 cp /tmp/gen/cpp/*.cpp ${ROBOT_DIR}/src/
 
-# remove the URDF and RobCoGen robot model files
+# remove the RobCoGen robot model and log files
 echo "Removing files..."
-rm -f ${ROBOT_DIR}/config/${ROBOT_NAME}.urdf 
 #rm -f ${ROBOT_DIR}/config/${ROBOT_NAME}.kindsl
 rm -f ${ROBOT_DIR}/maxima.log
 rm -f ${ROBOT_DIR}/robcogen.log